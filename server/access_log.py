@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import uuid
+import queue
+import random
+import logging
+import logging.handlers
+import contextvars
+
+# Fraction of successful requests that get an access log line (errors are always logged)
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", "1.0"))
+
+logger = logging.getLogger("access")
+
+_listener = None
+
+# Scope of the request being handled, for code that wants to attribute work
+# to a request (the route is filled in once routing has run)
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def start_logging():
+    """Route access log records through a queue so the event loop never blocks on I/O"""
+    global _listener
+    if _listener is not None:
+        return
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    _listener.start()
+
+
+def stop_logging():
+    """Flush pending access log records"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class AccessLogMiddleware:
+    """Pure ASGI middleware writing one structured line per HTTP request.
+
+    Bodies are never read or buffered: bytes in/out are counted as the
+    messages pass through. Each request gets an id (taken from X-Request-ID
+    when present) that is echoed back in the response headers.
+    """
+
+    def __init__(self, app, sample_rate: float = ACCESS_LOG_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        if not request_id:
+            request_id = uuid.uuid4().hex
+        scope.setdefault("state", {})["request_id"] = request_id
+
+        started_at = time.perf_counter()
+        info = {"status": 500, "bytes_in": 0, "bytes_out": 0}
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                info["bytes_in"] += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                info["status"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", request_id.encode("latin-1"))
+                ]
+            elif message["type"] == "http.response.body":
+                info["bytes_out"] += len(message.get("body", b""))
+            await send(message)
+
+        token = current_request.set(scope)
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            current_request.reset(token)
+            if info["status"] >= 500 or self.sample_rate >= 1 or random.random() < self.sample_rate:
+                logger.info(json.dumps({
+                    "request_id": request_id,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": info["status"],
+                    "latency_ms": round((time.perf_counter() - started_at) * 1000, 2),
+                    "bytes_in": info["bytes_in"],
+                    "bytes_out": info["bytes_out"],
+                    "client": scope["client"][0] if scope.get("client") else None,
+                }))
@@ -0,0 +1,135 @@
+import os
+import copy
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import jwt
+from dotenv import load_dotenv
+from db import users_collection
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+SECRET_KEY = os.getenv("SECRET_KEY")
+ALGORITHM = "HS256"
+
+# Verified-token cache settings
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# Upper bound on how stale a cached user document may get
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "300"))
+
+
+class UserNotFound(Exception):
+    """Raised when a valid token refers to a user that no longer exists"""
+
+
+class TokenCache:
+    """Bounded LRU mapping token -> (claims, user document, expiry)"""
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tokens_by_user = {}
+        # Set from a global counter on invalidation so lookups that raced with an
+        # update are not cached. Bounded like the tokens; users whose generation
+        # was evicted read the highest evicted value, which never goes backwards.
+        self._generations = OrderedDict()
+        self._generation_counter = 0
+        self._evicted_generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str):
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry["expires_at"] <= time.time():
+            self._remove(token)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return entry
+
+    def generation(self, username: str) -> int:
+        return self._generations.get(username, self._evicted_generation)
+
+    def put(self, token: str, claims: dict, user: dict, generation: int = None):
+        entry = {"claims": claims, "user": user}
+        if generation is not None and generation != self.generation(user["username"]):
+            return entry
+        expires_at = time.time() + self.ttl
+        if claims.get("exp"):
+            expires_at = min(expires_at, claims["exp"])
+        self._remove(token)
+        entry["expires_at"] = expires_at
+        self._entries[token] = entry
+        self._tokens_by_user.setdefault(user["username"], set()).add(token)
+        while len(self._entries) > self.max_size:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+        return entry
+
+    def invalidate_user(self, username: str):
+        """Drop every cached token of a user, e.g. after their document changed"""
+        self._generation_counter += 1
+        self._generations[username] = self._generation_counter
+        self._generations.move_to_end(username)
+        while len(self._generations) > self.max_size:
+            _, evicted = self._generations.popitem(last=False)
+            self._evicted_generation = max(self._evicted_generation, evicted)
+        for token in self._tokens_by_user.pop(username, set()):
+            self._entries.pop(token, None)
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is not None:
+            tokens = self._tokens_by_user.get(entry["user"]["username"])
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._tokens_by_user[entry["user"]["username"]]
+
+    def stats(self):
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+
+
+# Token validation
+def create_access_token(data: dict, expires_delta: timedelta = timedelta(days=7)):
+    to_encode = data.copy()
+    expire = datetime.utcnow() + expires_delta
+    to_encode.update({"exp": expire})
+    logger.info(f"Creating token with expiry: {expire} UTC")
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+
+async def authenticate(token: str):
+    """Return (claims, user document) for a token, using the cache when possible.
+
+    Raises jwt.InvalidTokenError for bad/expired tokens and UserNotFound when
+    the token's user does not exist. The returned user is a private copy.
+    """
+    entry = token_cache.get(token)
+    if entry is None:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        username = claims.get("sub")
+        if not username:
+            raise jwt.InvalidTokenError("Token has no subject")
+
+        generation = token_cache.generation(username)
+        user = await users_collection.find_one({"username": username}, {"password": 0})
+        if not user:
+            raise UserNotFound(username)
+
+        entry = token_cache.put(token, claims, user, generation)
+
+    return entry["claims"], copy.deepcopy(entry["user"])
@@ -0,0 +1,421 @@
+"""Load benchmark: seeds a synthetic dataset and drives mixed workloads
+through the ASGI app with httpx, reporting p50/p95/p99 latency and RPS.
+
+Usage:
+    python bench_load.py [--mongomock] [--db NAME] [--users N] [--courses N] [--reviews N]
+                         [--skip-seed] [--reset] [--mix mixed|browse|login|purchase|review]
+                         [--concurrency N] [--duration S] [--warmup S] [--seed S]
+                         [--output results.json] [--compare baseline.json] [--max-regression 0.1]
+
+Runs against MONGO_URI / --db (use a throwaway database: --reset drops its
+collections) or, with --mongomock, an in-memory stand-in (needs the
+mongomock-motor package; $text search is skipped there). The client and the
+app share one event loop, so absolute numbers include client overhead; compare
+runs made with the same options on the same machine.
+
+--output writes the report as JSON; --compare prints the change against such
+a baseline and exits with status 1 when p95 latency or throughput regressed by
+more than --max-regression.
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+import orjson
+
+logger = logging.getLogger(__name__)
+
+BENCH_PASSWORD = "BenchPassw0rd!"
+SEED_BATCH_SIZE = 10000
+SEARCH_TERMS = ["python", "react", "data", "docker", "design", "guitar", "finance", "rust"]
+DIFFICULTIES = ["beginner", "intermediate", "advanced"]
+
+# Share of each workload in a mix (weights)
+MIXES = {
+    "mixed": {"browse": 70, "login": 5, "purchase": 15, "review": 10},
+    "browse": {"browse": 1},
+    "login": {"login": 1},
+    "purchase": {"purchase": 1},
+    "review": {"review": 1},
+}
+
+
+class MongomockCollection:
+    """Adapts a mongomock-motor collection to the pymongo async API the app uses"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def aggregate(self, pipeline, **kwargs):
+        return self._collection.aggregate(pipeline, **kwargs)
+
+    async def bulk_write(self, operations, ordered=True):
+        # mongomock does not understand pymongo's request objects; apply them one by one
+        from types import SimpleNamespace
+        from pymongo import InsertOne, UpdateOne, UpdateMany
+        inserted = upserted = modified = 0
+        for op in operations:
+            if isinstance(op, InsertOne):
+                await self._collection.insert_one(op._doc)
+                inserted += 1
+            elif isinstance(op, (UpdateOne, UpdateMany)):
+                update = self._collection.update_one if isinstance(op, UpdateOne) else self._collection.update_many
+                result = await update(op._filter, op._doc, upsert=bool(op._upsert))
+                modified += result.modified_count
+                upserted += 1 if result.upserted_id else 0
+        return SimpleNamespace(inserted_count=inserted, upserted_count=upserted,
+                               modified_count=modified, matched_count=modified)
+
+
+def use_mongomock():
+    """Point the db module at an in-memory database. Must run before the app is imported."""
+    try:
+        import mongomock_motor
+    except ImportError:
+        sys.exit("--mongomock needs the mongomock-motor package")
+    import db
+
+    async def noop():
+        pass
+
+    database = mongomock_motor.AsyncMongoMockClient()[db.MONGO_DB_NAME]
+    db.db = database
+    db.connect = db.close = noop
+    for name in ("users", "courses", "reviews", "purchases", "jobs"):
+        setattr(db, f"{name}_collection", MongomockCollection(database[name]))
+
+    # mongomock ignores partialFilterExpression: the partial unique
+    # external_id index would reject every course without an external_id
+    import indexes
+    for name, models in indexes.INDEXES.items():
+        indexes.INDEXES[name] = [model for model in models if "partialFilterExpression" not in model.document]
+
+
+async def insert_batches(collection, docs):
+    """insert_many in batches; duplicates of an earlier seed are skipped"""
+    from pymongo.errors import BulkWriteError
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= SEED_BATCH_SIZE:
+            try:
+                await collection.insert_many(batch, ordered=False)
+            except BulkWriteError:
+                pass
+            batch = []
+    if batch:
+        try:
+            await collection.insert_many(batch, ordered=False)
+        except BulkWriteError:
+            pass
+
+
+def bench_user(n: int) -> dict:
+    return {"username": f"benchuser{n}", "email": f"benchuser{n}@bench.local"}
+
+
+async def seed(users: int, courses: int, reviews: int, seed_value: int = 0):
+    """Create users, instructors, a synthetic catalog and reviewed purchases.
+    Every user shares one password hash, so seeding costs one bcrypt call."""
+    import db
+    import ratings
+    import passwords
+    import course_import
+
+    rng = random.Random(seed_value)
+    started_at = time.perf_counter()
+    password = passwords.pwd_context.hash(BENCH_PASSWORD)
+    instructor_count = max(1, courses // 50)
+
+    await insert_batches(db.users_collection, (
+        {"username": f"instructor{n}", "email": f"instructor{n}@bench.local", "password": password,
+         "role": "instructor", "isVerified": rng.random() < 0.5, "balance": 0}
+        for n in range(instructor_count)
+    ))
+    await insert_batches(db.users_collection, (
+        {**bench_user(n), "password": password, "role": "student", "balance": 10 ** 9}
+        for n in range(users)
+    ))
+    report = await course_import.import_rows(course_import.generate_courses(courses, instructor_count, seed_value))
+
+    # Review k belongs to user k % users and, for that user, the (k // users)-th
+    # course after their own offset, so (user, course) pairs never repeat
+    reviews = min(reviews, users * courses)
+    if reviews:
+        user_ids = {}
+        async for user in db.users_collection.find({"role": "student", "username": {"$regex": "^benchuser"}},
+                                                   {"username": 1}):
+            user_ids[user["username"]] = str(user["_id"])
+        course_ids = [str(course["_id"]) async for course in db.courses_collection.find(
+            {"external_id": {"$regex": f"^synthetic-{seed_value}-"}}, {"_id": 1})]
+
+        def pairs():
+            for k in range(reviews):
+                u = k % users
+                yield u, course_ids[(k // users + u) % len(course_ids)]
+
+        now = datetime.utcnow()
+        await insert_batches(db.purchases_collection, (
+            {"user_id": user_ids[f"benchuser{u}"], "username": f"benchuser{u}", "course_id": course_id,
+             "course_title": "", "price": 0, "purchase_date": now, "purchase_key": f"bench-{u}-{course_id}"}
+            for u, course_id in pairs()
+        ))
+        await insert_batches(db.reviews_collection, (
+            {"course_id": course_id, "user_id": user_ids[f"benchuser{u}"], "username": f"benchuser{u}",
+             "rating": float(rng.randint(1, 5)), "comment": "Synthetic review", "created_at": now}
+            for u, course_id in pairs()
+        ))
+        await ratings.reconcile_course_ratings()
+
+    logger.info(f"Seeded {users} users, {report['processed']} courses and {reviews} reviews "
+                f"in {time.perf_counter() - started_at:.1f}s")
+
+
+class Recorder:
+    """Latency samples per operation"""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.recording = False
+
+    async def call(self, name: str, request, expected=(200,)):
+        started_at = time.perf_counter()
+        try:
+            response = await request
+            ok = response.status_code in expected
+        except Exception as e:
+            logger.debug(f"{name} failed: {e}")
+            response, ok = None, False
+        elapsed = time.perf_counter() - started_at
+        if self.recording:
+            self.samples.setdefault(name, []).append(elapsed)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+        return response
+
+
+class VirtualUser:
+    def __init__(self, client, recorder, context, rng, text_search=True):
+        self.client = client
+        self.recorder = recorder
+        self.context = context
+        self.rng = rng
+        self.text_search = text_search
+        self.n = rng.randrange(context["users"])
+        self.headers = {"Authorization": f"Bearer {context['tokens'][self.n]}", "Accept-Encoding": "gzip"}
+
+    def course_id(self):
+        return self.rng.choice(self.context["course_ids"])
+
+    async def browse(self):
+        rng, call = self.rng, self.recorder.call
+        response = await call("GET /courses", self.client.get("/courses", params={"limit": 20}, headers=self.headers))
+        cursor = response.headers.get("X-Next-Cursor") if response is not None else None
+        if cursor and rng.random() < 0.3:
+            await call("GET /courses (next page)", self.client.get(
+                "/courses", params={"limit": 20, "after": cursor}, headers=self.headers))
+        params = {"difficulty": rng.choice(DIFFICULTIES), "min_rating": rng.choice([0, 3, 4])}
+        if self.text_search:
+            params["q"] = rng.choice(SEARCH_TERMS)
+        await call("GET /courses/search", self.client.get("/courses/search", params=params, headers=self.headers))
+        await call("GET /courses/{id}", self.client.get(f"/courses/{self.course_id()}", headers=self.headers))
+
+    async def login(self):
+        await self.recorder.call("POST /login", self.client.post(
+            "/login", json={"email": bench_user(self.n)["email"], "password": BENCH_PASSWORD}))
+
+    async def purchase(self):
+        # Buying an owned course is answered 400, which is part of the workload
+        await self.recorder.call("POST /courses/{id}/purchase", self.client.post(
+            f"/courses/{self.course_id()}/purchase", headers=self.headers), expected=(200, 400))
+
+    async def review(self):
+        course_id = self.course_id()
+        await self.client.post(f"/courses/{course_id}/purchase", headers=self.headers)
+        await self.recorder.call("POST /api/courses/{id}/reviews", self.client.post(
+            f"/api/courses/{course_id}/reviews",
+            json={"rating": self.rng.randint(1, 5), "comment": "Benchmark review"},
+            headers=self.headers
+        ), expected=(200, 400))
+
+    async def run(self, mix: dict, deadline: float):
+        workloads, weights = list(mix), list(mix.values())
+        while time.perf_counter() < deadline:
+            await getattr(self, self.rng.choices(workloads, weights)[0])()
+
+
+def percentile(sorted_samples: list, pct: float) -> float:
+    """Nearest-rank percentile"""
+    index = max(0, min(len(sorted_samples) - 1, int(round(pct / 100 * len(sorted_samples) + 0.5)) - 1))
+    return sorted_samples[index]
+
+
+def summarize(samples: list, errors: int, seconds: float) -> dict:
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "rps": round(len(samples) / seconds, 1),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 2),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "max_ms": round(samples[-1] * 1000, 2),
+    }
+
+
+async def run_workload(app, context, mix: dict, concurrency: int, duration: float, warmup: float,
+                       seed_value: int = 0, text_search: bool = True) -> dict:
+    import httpx
+    recorder = Recorder()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        vus = [VirtualUser(client, recorder, context, random.Random(seed_value + i), text_search)
+               for i in range(concurrency)]
+        if warmup:
+            deadline = time.perf_counter() + warmup
+            await asyncio.gather(*(vu.run(mix, deadline) for vu in vus))
+        recorder.recording = True
+        started_at = time.perf_counter()
+        await asyncio.gather(*(vu.run(mix, started_at + duration) for vu in vus))
+        seconds = time.perf_counter() - started_at
+
+    operations = {name: summarize(samples, recorder.errors.get(name, 0), seconds)
+                  for name, samples in sorted(recorder.samples.items())}
+    everything = [s for samples in recorder.samples.values() for s in samples]
+    total = summarize(everything, sum(recorder.errors.values()), seconds) if everything else {}
+    return {"seconds": round(seconds, 2), "total": total, "operations": operations}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_report(report: dict):
+    print(f"{report['meta']['mix']} mix, {report['meta']['concurrency']} virtual users, {report['seconds']}s")
+    print(f"  {'operation':34} {'count':>7} {'err':>5} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, row in [*report["operations"].items(), ("total", report["total"])]:
+        if row:
+            print(f"  {name:34} {row['count']:7} {row['errors']:5} {row['rps']:8.1f} "
+                  f"{row['p50_ms']:8.2f} {row['p95_ms']:8.2f} {row['p99_ms']:8.2f}")
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> bool:
+    """Print the change against a baseline; returns False on a regression"""
+    print(f"compared with {baseline['meta'].get('commit') or 'baseline'} ({baseline['meta'].get('date')})")
+    for key in ("backend", "mix", "concurrency"):
+        if baseline["meta"].get(key) != report["meta"][key]:
+            print(f"  warning: {key} differs ({baseline['meta'].get(key)} in the baseline)")
+    ok = True
+    rows = [*report["operations"].items(), ("total", report["total"])]
+    for name, row in rows:
+        base = baseline["total"] if name == "total" else baseline["operations"].get(name)
+        if not row or not base:
+            continue
+        p95 = row["p95_ms"] / base["p95_ms"] - 1 if base["p95_ms"] else 0
+        rps = row["rps"] / base["rps"] - 1 if base["rps"] else 0
+        regressed = p95 > max_regression or rps < -max_regression
+        ok = ok and not regressed
+        print(f"  {name:34} p50 {row['p50_ms'] - base['p50_ms']:+8.2f} ms  p95 {p95:+7.1%}  "
+              f"p99 {row['p99_ms'] - base['p99_ms']:+8.2f} ms  rps {rps:+7.1%}{'  REGRESSED' if regressed else ''}")
+    return ok
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the API with synthetic data and mixed workloads")
+    parser.add_argument("--mongomock", action="store_true", help="use an in-memory Mongo stand-in")
+    parser.add_argument("--db", help="database name (defaults to MONGO_DB_NAME)")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--courses", type=int, default=1000)
+    parser.add_argument("--reviews", type=int, default=5000)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse data seeded by an earlier run")
+    parser.add_argument("--reset", action="store_true", help="drop the collections before seeding")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="mixed")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--compare", help="JSON baseline to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    if args.db:
+        os.environ["MONGO_DB_NAME"] = args.db
+    # The virtual users all come from one address and log in far more often
+    # than the limits allow; measure the handlers, not the limiter
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    if args.mongomock:
+        use_mongomock()
+    # Imported late so the database settings above apply
+    import db
+    import main as api
+    from auth import create_access_token
+
+    if args.reset:
+        for name in ("users", "courses", "reviews", "purchases", "jobs"):
+            await db.db.drop_collection(name)
+    await api.startup_event()
+    try:
+        if not args.skip_seed:
+            await seed(args.users, args.courses, args.reviews, args.seed)
+
+        users = await db.users_collection.count_documents({"username": {"$regex": "^benchuser"}})
+        if not users:
+            sys.exit("No benchmark users; run without --skip-seed first")
+        users = min(users, args.users)
+        course_ids = [str(course["_id"]) async for course in db.courses_collection.find({}, {"_id": 1}).limit(10000)]
+        context = {
+            "users": users,
+            "tokens": [create_access_token({"sub": f"benchuser{n}", "role": "student"}) for n in range(users)],
+            "course_ids": course_ids,
+        }
+
+        result = await run_workload(api.app, context, MIXES[args.mix], args.concurrency, args.duration,
+                                    args.warmup, args.seed, text_search=not args.mongomock)
+    finally:
+        await api.shutdown_event()
+
+    report = {
+        "meta": {
+            "date": datetime.utcnow().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "backend": "mongomock" if args.mongomock else "mongodb",
+            "mix": args.mix,
+            "concurrency": args.concurrency,
+            "users": users,
+            "courses": len(course_ids),
+            "seed": args.seed,
+        },
+        **result,
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+    if args.compare:
+        with open(args.compare, "rb") as f:
+            baseline = orjson.loads(f.read())
+        if not compare(report, baseline, args.max_regression):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,74 @@
+"""Compare per-response serialization cost of the old dumps->loads->JSONResponse
+path against BSONResponse on synthetic catalog pages.
+
+Usage: python bench_serialization.py [courses_per_response] [iterations]
+"""
+import sys
+import json
+import time
+from datetime import datetime
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from responses import BSONResponse
+
+
+class CustomJSONEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, datetime):
+            return obj.isoformat()
+        if isinstance(obj, ObjectId):
+            return str(obj)
+        return super().default(obj)
+
+
+def make_courses(count):
+    return [
+        {
+            "_id": ObjectId(),
+            "title": f"Course {i}",
+            "description": "Learn something useful with hands-on projects " * 3,
+            "difficulty": ["beginner", "intermediate", "advanced"][i % 3],
+            "rating": round(1 + (i % 40) / 10, 1),
+            "rating_count": i * 7,
+            "price": 9.99 + i,
+            "instructor": {"username": f"instructor{i % 50}", "isVerified": i % 2 == 0},
+            "video_urls": [f"https://res.cloudinary.com/demo/video/upload/{i}.mp4"],
+            "created_at": datetime.utcnow(),
+            "reviews": [
+                {"_id": ObjectId(), "username": f"user{j}", "rating": 4, "comment": "Great course",
+                 "created_at": datetime.utcnow()}
+                for j in range(5)
+            ],
+        }
+        for i in range(count)
+    ]
+
+
+def old_path(courses):
+    content = json.loads(json.dumps(courses, cls=CustomJSONEncoder))
+    return JSONResponse(content=content).body
+
+
+def new_path(courses):
+    return BSONResponse(content=courses).body
+
+
+def bench(func, courses, iterations):
+    func(courses)  # warm up
+    start = time.process_time()
+    for _ in range(iterations):
+        func(courses)
+    return (time.process_time() - start) / iterations * 1000
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    courses = make_courses(size)
+
+    old_ms = bench(old_path, courses, iterations)
+    new_ms = bench(new_path, courses, iterations)
+    print(f"{size} courses/response, {iterations} iterations (CPU time per response)")
+    print(f"  dumps->loads->JSONResponse: {old_ms:8.3f} ms")
+    print(f"  BSONResponse (orjson):      {new_ms:8.3f} ms")
+    print(f"  speedup:                    {old_ms / new_ms:8.1f}x")
@@ -0,0 +1,244 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+import orjson
+import responses
+from responses import dumps
+
+logger = logging.getLogger(__name__)
+
+# Entries kept in the in-process LRU
+CACHE_LOCAL_SIZE = int(os.getenv("CACHE_LOCAL_SIZE", "5000"))
+# With a shared backend, local copies live at most this long so other
+# processes' invalidations are picked up quickly
+CACHE_LOCAL_TTL = int(os.getenv("CACHE_LOCAL_TTL", "5"))
+# Optional shared cache: "none", "local" (in-process stand-in) or "redis"
+CACHE_SHARED = os.getenv("CACHE_SHARED", "none")
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+# Per-namespace TTLs in seconds
+CACHE_TTLS = {
+    "catalog": int(os.getenv("CACHE_TTL_CATALOG", "60")),
+    "course": int(os.getenv("CACHE_TTL_COURSE", "300")),
+}
+
+
+class MemoryBackend:
+    """Bounded LRU of key -> value with a per-entry expiry"""
+
+    def __init__(self, max_size: int = CACHE_LOCAL_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        # Counters never expire nor get evicted
+        self._counters = {}
+
+    async def get(self, key: str):
+        if key in self._counters:
+            return self._counters[key]
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value, ttl: int):
+        self._entries[key] = (time.time() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    async def incr(self, key: str) -> int:
+        self._counters[key] = self._counters.get(key, 0) + 1
+        return self._counters[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LocalSharedBackend(MemoryBackend):
+    """Stand-in for a shared cache: values are stored serialized, exactly as a
+    network cache would hold them, but in this process"""
+
+    async def get(self, key):
+        value = await super().get(key)
+        return orjson.loads(value) if isinstance(value, bytes) else value
+
+    async def set(self, key, value, ttl):
+        await super().set(key, dumps(value), ttl)
+
+
+class RedisBackend:
+    """Shared cache on Redis (needs the optional `redis` package)"""
+
+    def __init__(self, url: str = CACHE_REDIS_URL):
+        import redis.asyncio as redis
+        self.client = redis.from_url(url)
+
+    async def get(self, key):
+        value = await self.client.get(key)
+        return orjson.loads(value) if value is not None else None
+
+    async def set(self, key, value, ttl):
+        await self.client.set(key, dumps(value), ex=ttl)
+
+    async def delete(self, key):
+        await self.client.delete(key)
+
+    async def incr(self, key):
+        return await self.client.incr(key)
+
+
+def create_shared_backend(name: str = CACHE_SHARED):
+    if name == "none":
+        return None
+    if name == "local":
+        return LocalSharedBackend()
+    if name == "redis":
+        return RedisBackend()
+    raise ValueError(f"Unknown shared cache backend: {name}")
+
+
+class Cache:
+    """Read-through cache with an in-process LRU in front of an optional shared
+    backend. Keys live in namespaces whose version is bumped to invalidate
+    every key of the namespace at once. pack/unpack convert values to and from
+    a JSON-safe form on their way through the shared backend only."""
+
+    def __init__(self, local: MemoryBackend, shared=None, local_ttl: int = CACHE_LOCAL_TTL,
+                 pack=None, unpack=None):
+        self.local = local
+        self.shared = shared
+        self.local_ttl = local_ttl
+        self.pack = pack or (lambda value: value)
+        self.unpack = unpack or (lambda value: value)
+        self._loading = {}
+        self._stats = {}
+        # Namespace versions and key generations, kept out of the LRU so they
+        # are never evicted
+        self._versions = {}
+
+    def _count(self, namespace: str, field: str):
+        counts = self._stats.setdefault(namespace, {"hits": 0, "misses": 0, "invalidations": 0})
+        counts[field] += 1
+
+    async def _counter(self, name: str) -> int:
+        if self.shared is None:
+            return self._versions.get(name, 0)
+        return await self.shared.get(name) or 0
+
+    async def _bump(self, name: str):
+        if self.shared is None:
+            self._versions[name] = self._versions.get(name, 0) + 1
+        else:
+            await self.shared.incr(name)
+
+    async def _key(self, namespace: str, key: str):
+        """Full key stamped with the namespace version and the key's own
+        generation, or None when the shared backend cannot be read. A load
+        racing an invalidation thus writes to a key nobody reads any more."""
+        try:
+            version = await self._counter(f"{namespace}:version")
+            generation = await self._counter(f"{namespace}:generation:{key}")
+        except Exception as e:
+            logger.error(f"Shared cache version read failed: {str(e)}")
+            return None
+        return f"{namespace}:{version}:{key}:{generation}"
+
+    async def get_or_load(self, namespace: str, key: str, loader):
+        """Return the cached value or call loader() and cache its result.
+        Concurrent misses for the same key share a single load."""
+        full_key = await self._key(namespace, key)
+        if full_key is None:
+            # Without versions a cached value may be stale; skip the cache
+            self._count(namespace, "misses")
+            return await loader()
+        value = await self.local.get(full_key)
+        if value is None and self.shared is not None:
+            try:
+                value = await self.shared.get(full_key)
+                if value is not None:
+                    value = self.unpack(value)
+            except Exception as e:
+                logger.error(f"Shared cache read failed: {str(e)}")
+            if value is not None:
+                await self.local.set(full_key, value, self.local_ttl)
+        if value is not None:
+            self._count(namespace, "hits")
+            return value
+
+        self._count(namespace, "misses")
+        if full_key in self._loading:
+            return await asyncio.shield(self._loading[full_key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[full_key] = future
+        try:
+            value = await loader()
+            # None is never a hit, and a value loaded while the key was
+            # invalidated may predate the change
+            if value is not None and await self._key(namespace, key) == full_key:
+                await self.set(full_key, value, CACHE_TTLS.get(namespace, 60))
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody may be waiting; retrieve it so asyncio does not warn
+            future.exception()
+            raise
+        finally:
+            del self._loading[full_key]
+
+    async def set(self, full_key: str, value, ttl: int):
+        await self.local.set(full_key, value, min(ttl, self.local_ttl) if self.shared else ttl)
+        if self.shared is not None:
+            try:
+                await self.shared.set(full_key, self.pack(value), ttl)
+            except Exception as e:
+                logger.error(f"Shared cache write failed: {str(e)}")
+
+    async def invalidate(self, namespace: str, key: str = None):
+        """Drop one key (by bumping its generation), or the whole namespace
+        when no key is given. Best effort: shared backend errors are logged."""
+        self._count(namespace, "invalidations")
+        name = f"{namespace}:version" if key is None else f"{namespace}:generation:{key}"
+        try:
+            await self._bump(name)
+        except Exception as e:
+            logger.error(f"Shared cache invalidation of {name} failed: {str(e)}")
+
+    def stats(self):
+        namespaces = {}
+        for namespace, counts in self._stats.items():
+            lookups = counts["hits"] + counts["misses"]
+            namespaces[namespace] = {**counts, "hit_ratio": round(counts["hits"] / lookups, 4) if lookups else None}
+        return {
+            "local_size": len(self.local),
+            "shared": type(self.shared).__name__ if self.shared else None,
+            "ttls": CACHE_TTLS,
+            "namespaces": namespaces,
+        }
+
+
+# Values are rendered bodies (responses.render): raw bytes in this process,
+# packed as text/base64 in the shared backend
+catalog_cache = Cache(MemoryBackend(), create_shared_backend(), pack=responses.pack, unpack=responses.unpack)
+
+
+async def invalidate_course(course_id: str = None):
+    """Invalidate after a course changed: its detail entry and every catalog
+    page (filters and sort orders may all include it). Without an id every
+    course detail entry is dropped."""
+    if course_id is None:
+        await catalog_cache.invalidate("course")
+    else:
+        await catalog_cache.invalidate("course", str(course_id))
+    await catalog_cache.invalidate("catalog")
@@ -0,0 +1,260 @@
+import os
+import gzip
+import time
+import zlib
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Optional codecs: brotli and zstd are offered when their packages are installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bodies smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# CPU time (ms per second) request-time compression may use; past it responses go out uncompressed
+COMPRESSION_CPU_BUDGET_MS = float(os.getenv("COMPRESSION_CPU_BUDGET_MS", "250"))
+# Bodies larger than this are compressed off the event loop
+COMPRESSION_THREAD_SIZE = int(os.getenv("COMPRESSION_THREAD_SIZE", str(256 * 1024)))
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/", "application/javascript")
+
+
+class Codec:
+    """One content coding with a fast level for request-time compression and a
+    slow, denser one for payloads compressed once and cached"""
+
+    def __init__(self, name, compress, stream, fast_level, best_level):
+        self.name = name
+        self._compress = compress
+        self._stream = stream
+        self.fast_level = fast_level
+        self.best_level = best_level
+
+    def compress(self, data: bytes, best: bool = False) -> bytes:
+        return self._compress(data, self.best_level if best else self.fast_level)
+
+    def stream(self):
+        """Return (compress(chunk) -> bytes, finish() -> bytes) for streamed bodies"""
+        return self._stream(self.fast_level)
+
+
+def _gzip_stream(level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return (lambda chunk: compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)), compressor.flush
+
+
+def _brotli_stream(level):
+    compressor = brotli.Compressor(quality=level)
+    return (lambda chunk: compressor.process(chunk) + compressor.flush()), compressor.finish
+
+
+def _zstd_stream(level):
+    compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    return (
+        lambda chunk: compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+    ), compressor.flush
+
+
+# Server preference when the client accepts several codings equally
+CODECS = {}
+if zstandard is not None:
+    CODECS["zstd"] = Codec(
+        "zstd", lambda data, level: zstandard.ZstdCompressor(level=level).compress(data), _zstd_stream, 3, 12
+    )
+if brotli is not None:
+    CODECS["br"] = Codec("br", lambda data, level: brotli.compress(data, quality=level), _brotli_stream, 4, 9)
+CODECS["gzip"] = Codec("gzip", lambda data, level: gzip.compress(data, level, mtime=0), _gzip_stream, 5, 9)
+
+
+def negotiate(accept_encoding: str):
+    """Pick the codec for an Accept-Encoding header, or None for identity"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+
+    best, best_q = None, 0.0
+    for name in CODECS:
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return CODECS.get(best)
+
+
+def precompress(body: bytes) -> dict:
+    """Compress a body with every codec at its best level, for bodies that are
+    cached and served many times"""
+    if len(body) < COMPRESSION_MIN_SIZE:
+        return {}
+    return {name: codec.compress(body, best=True) for name, codec in CODECS.items()}
+
+
+async def precompress_async(body: bytes) -> dict:
+    """precompress in a thread: the best levels take tens of ms on a large
+    page. The time is charged to the request-time compression budget."""
+    if len(body) < COMPRESSION_MIN_SIZE:
+        return {}
+    started_at = time.perf_counter()
+    encoded = await asyncio.to_thread(precompress, body)
+    budget.charge(time.perf_counter() - started_at)
+    return encoded
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """Distinct strong ETag per content coding"""
+    if etag.endswith('"'):
+        return f'{etag[:-1]}-{encoding}"'
+    return etag
+
+
+class CpuBudget:
+    """Tracks compression time spent in the current one-second window"""
+
+    def __init__(self, ms_per_second: float = COMPRESSION_CPU_BUDGET_MS):
+        self.budget = ms_per_second / 1000
+        self.window_start = time.monotonic()
+        self.spent = 0.0
+        self.skipped = 0
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        if now - self.window_start >= 1:
+            self.window_start = now
+            self.spent = 0.0
+        if self.spent < self.budget:
+            return True
+        self.skipped += 1
+        return False
+
+    def charge(self, seconds: float):
+        self.spent += seconds
+
+
+budget = CpuBudget()
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware compressing compressible responses according to
+    Accept-Encoding. Responses that already have a Content-Encoding (e.g.
+    precompressed catalog pages) pass through untouched."""
+
+    def __init__(self, app, min_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for name, value in scope.get("headers", []):
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        codec = negotiate(accept_encoding)
+        if codec is None:
+            await self.app(scope, receive, send)
+            return
+
+        state = {"start": None, "stream": None, "passthrough": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = {k.lower(): v for k, v in message.get("headers", [])}
+                content_type = headers.get(b"content-type", b"").decode("latin-1")
+                if (
+                    b"content-encoding" in headers
+                    or message["status"] in (204, 304)
+                    or b"no-transform" in headers.get(b"cache-control", b"")
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)
+                ):
+                    state["passthrough"] = True
+                    await send(message)
+                else:
+                    # Hold the start until we know whether the body gets compressed
+                    state["start"] = message
+                return
+
+            if state["passthrough"]:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if state["start"] is not None:
+                start, state["start"] = state["start"], None
+                if not more_body:
+                    # Whole body in one message
+                    if len(body) < self.min_size or not budget.allow():
+                        await send(with_vary(start))
+                        await send(message)
+                        return
+                    started_at = time.perf_counter()
+                    if len(body) >= COMPRESSION_THREAD_SIZE:
+                        compressed = await asyncio.to_thread(codec.compress, body)
+                    else:
+                        compressed = codec.compress(body)
+                    budget.charge(time.perf_counter() - started_at)
+                    await send(encoded_start(start, codec.name, len(compressed)))
+                    await send({"type": "http.response.body", "body": compressed, "more_body": False})
+                    return
+
+                # Streamed body: compress chunk by chunk
+                state["stream"] = codec.stream()
+                await send(encoded_start(start, codec.name, None))
+
+            compress_chunk, finish = state["stream"]
+            data = compress_chunk(body) if body else b""
+            if not more_body:
+                data += finish()
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def with_vary(start: dict) -> dict:
+    """Add Accept-Encoding to the Vary header, keeping what is already there"""
+    headers, vary = [], []
+    for name, value in start.get("headers", []):
+        if name.lower() == b"vary":
+            vary.extend(v.strip() for v in value.split(b",") if v.strip())
+        else:
+            headers.append((name, value))
+    if b"accept-encoding" not in (v.lower() for v in vary):
+        vary.append(b"Accept-Encoding")
+    headers.append((b"vary", b", ".join(vary)))
+    return {**start, "headers": headers}
+
+
+def encoded_start(start: dict, encoding: str, length):
+    headers = []
+    for name, value in with_vary(start)["headers"]:
+        lowered = name.lower()
+        if lowered == b"content-length":
+            continue
+        if lowered == b"etag":
+            value = encoded_etag(value.decode("latin-1"), encoding).encode("latin-1")
+        headers.append((name, value))
+    headers.append((b"content-encoding", encoding.encode("latin-1")))
+    if length is not None:
+        headers.append((b"content-length", str(length).encode("latin-1")))
+    return {**start, "headers": headers}
@@ -0,0 +1,270 @@
+"""Bulk course import and synthetic catalog generation.
+
+Usage:
+    python course_import.py import courses.jsonl|courses.csv [--batch-size N]
+    python course_import.py generate COUNT [--output FILE] [--instructors N] [--seed S]
+    python course_import.py synthetic COUNT [--instructors N] [--seed S]
+
+Rows are validated against CourseCreate plus an `instructor` username and an
+optional `external_id`. Rows with an external_id are upserted on it, so
+re-running an import updates courses instead of duplicating them. CSV files
+separate video URLs with "|".
+"""
+import os
+import csv
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+from itertools import islice
+from typing import Optional
+import orjson
+from pydantic import Field, ValidationError
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from db import courses_collection, users_collection
+from courses import CourseCreate, course_document
+import ingest
+import storage
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+# Row errors kept in the report (all of them are counted)
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "100"))
+
+# Fields a re-import overwrites. instructor_info goes with instructor: it is
+# rebuilt from the users collection, so a changed instructor never keeps the
+# previous one's name and verification. The rest of the document (rating,
+# the review aggregates, pending_uploads, created_at) is maintained by the
+# app and only written when the upsert inserts the course.
+CATALOG_FIELDS = ("title", "description", "difficulty", "price", "ratings", "video_urls", "instructor", "instructor_info")
+
+
+class CourseImportRow(CourseCreate):
+    instructor: str = Field(..., min_length=1, max_length=50)
+    external_id: Optional[str] = Field(None, min_length=1, max_length=100)
+
+
+def detect_format(filename: str) -> str:
+    return "csv" if (filename or "").lower().endswith(".csv") else "jsonl"
+
+
+def iter_rows(stream, fmt: str):
+    """Yield (line number, row dict or parse error) from a text stream"""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            row = {k: v for k, v in row.items() if k and v not in (None, "")}
+            if "video_urls" in row:
+                row["video_urls"] = [url.strip() for url in row["video_urls"].split("|") if url.strip()]
+            yield reader.line_num, row
+        return
+
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = orjson.loads(line)
+        except orjson.JSONDecodeError as e:
+            yield line_no, ValueError(f"Invalid JSON: {e}")
+            continue
+        yield line_no, row if isinstance(row, dict) else ValueError("Row is not an object")
+
+
+def read_batch(rows, size: int):
+    """Parse and validate up to size rows. Returns (valid, errors, rows read),
+    valid being (line number, CourseImportRow) pairs. CPU bound; run it in a thread."""
+    valid, errors, read = [], [], 0
+    for line_no, row in islice(rows, size):
+        read += 1
+        if isinstance(row, Exception):
+            errors.append({"row": line_no, "errors": [str(row)]})
+            continue
+        try:
+            course = CourseImportRow.model_validate(row)
+        except ValidationError as e:
+            errors.append({"row": line_no, "errors": [
+                f"{'.'.join(str(part) for part in err['loc']) or 'row'}: {err['msg']}" for err in e.errors()
+            ]})
+            continue
+        if any(ingest.is_pending_ref(url) for url in course.video_urls):
+            errors.append({"row": line_no, "errors": ["video_urls: pending uploads cannot be imported"]})
+            continue
+        valid.append((line_no, course))
+    return valid, errors, read
+
+
+async def write_batch(valid: list, verified: dict):
+    """Write one batch with an unordered bulk_write. Returns (counts, errors)."""
+    # Verification status of instructors not seen in earlier batches
+    unknown = {course.instructor for _, course in valid} - verified.keys()
+    if unknown:
+        async for user in users_collection.find(
+            {"role": "instructor", "username": {"$in": list(unknown)}}, {"username": 1, "isVerified": 1}
+        ):
+            verified[user["username"]] = user.get("isVerified", False)
+        for username in unknown:
+            verified.setdefault(username, False)
+
+    operations, line_numbers = [], []
+    for line_no, course in valid:
+        doc = course_document(course, course.instructor, verified[course.instructor])
+        external_id = doc.pop("external_id", None)
+        if external_id:
+            catalog = {field: doc.pop(field) for field in CATALOG_FIELDS}
+            operations.append(UpdateOne(
+                {"external_id": external_id},
+                {"$set": catalog, "$setOnInsert": {**doc, "external_id": external_id}},
+                upsert=True
+            ))
+        else:
+            operations.append(InsertOne(doc))
+        line_numbers.append(line_no)
+
+    errors = []
+    try:
+        result = await courses_collection.bulk_write(operations, ordered=False)
+        counts = {"inserted": result.inserted_count, "upserted": result.upserted_count, "modified": result.modified_count}
+    except BulkWriteError as e:
+        details = e.details
+        counts = {"inserted": details.get("nInserted", 0), "upserted": details.get("nUpserted", 0), "modified": details.get("nModified", 0)}
+        for err in details.get("writeErrors", []):
+            errors.append({"row": line_numbers[err["index"]], "errors": [err.get("errmsg", "Write failed")]})
+    return counts, errors
+
+
+async def import_rows(rows, batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+    """Import (line number, row) pairs in batches. Validation of the next batch
+    runs in a thread while the previous batch is being written."""
+    report = {"processed": 0, "inserted": 0, "upserted": 0, "modified": 0, "failed": 0, "errors": []}
+    verified = {}
+    started_at = time.perf_counter()
+
+    def add_errors(errors):
+        report["failed"] += len(errors)
+        report["errors"].extend(errors[:max(0, IMPORT_MAX_ERRORS - len(report["errors"]))])
+
+    async def finish(task):
+        counts, errors = await task
+        for key, value in counts.items():
+            report[key] += value
+        add_errors(errors)
+
+    pending = None
+    while True:
+        valid, errors, read = await asyncio.to_thread(read_batch, rows, batch_size)
+        if not read:
+            break
+        report["processed"] += read
+        add_errors(errors)
+        if pending is not None:
+            await finish(pending)
+            pending = None
+        if valid:
+            pending = asyncio.create_task(write_batch(valid, verified))
+    if pending is not None:
+        await finish(pending)
+
+    report["seconds"] = round(time.perf_counter() - started_at, 3)
+    report["rows_per_second"] = round(report["processed"] / report["seconds"]) if report["seconds"] else None
+    logger.info(
+        f"Imported {report['processed']} rows in {report['seconds']}s: {report['inserted']} inserted, "
+        f"{report['upserted']} upserted, {report['modified']} modified, {report['failed']} failed"
+    )
+    return report
+
+
+TOPICS = ["Python", "JavaScript", "React", "Data Science", "Machine Learning", "SQL", "Docker",
+          "Kubernetes", "Go", "Rust", "Design", "Photography", "Marketing", "Finance", "Guitar"]
+LEVELS = ["beginner", "intermediate", "advanced"]
+ANGLES = ["Introduction to", "Mastering", "Practical", "Hands-on", "The Complete Guide to", "Advanced"]
+
+
+def generate_courses(count: int, instructors: int = 100, seed: int = 0):
+    """Yield (line number, row) pairs of a synthetic catalog. Rows get stable
+    external ids, so generating again with the same seed updates in place."""
+    rng = random.Random(seed)
+    prefix = storage.backend.url_prefix
+    for i in range(count):
+        topic = rng.choice(TOPICS)
+        level = rng.choice(LEVELS)
+        yield i + 1, {
+            "external_id": f"synthetic-{seed}-{i}",
+            "title": f"{rng.choice(ANGLES)} {topic} #{i}",
+            "description": f"A {level} course on {topic.lower()} with {rng.randint(3, 40)} lessons and projects.",
+            "difficulty": level,
+            "price": round(rng.choice([0, rng.uniform(5, 200)]), 2),
+            "ratings": round(rng.uniform(1, 5), 1),
+            "video_urls": [f"{prefix}synthetic/{i}/{n}.mp4" for n in range(rng.randint(1, 4))],
+            "instructor": f"instructor{rng.randrange(instructors)}",
+        }
+
+
+SAMPLE_COURSES = [
+    {
+        "external_id": "sample-python",
+        "title": "Introduction to Python",
+        "description": "Learn Python programming from scratch",
+        "difficulty": "beginner",
+        "instructor": "John Doe",
+        "ratings": 4.5,
+        "price": 49.99,
+    },
+    {
+        "external_id": "sample-react",
+        "title": "Web Development with React",
+        "description": "Master React.js and build modern web apps",
+        "difficulty": "intermediate",
+        "instructor": "Jane Smith",
+        "ratings": 4.8,
+        "price": 79.99,
+    },
+]
+
+
+def sample_rows():
+    for n, course in enumerate(SAMPLE_COURSES, 1):
+        yield n, {**course, "video_urls": [f"{storage.backend.url_prefix}samples/{course['external_id']}.mp4"]}
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import courses or generate a synthetic catalog")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_cmd = commands.add_parser("import", help="import a JSONL or CSV file")
+    import_cmd.add_argument("path")
+    import_cmd.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    for name in ("generate", "synthetic"):
+        cmd = commands.add_parser(name, help="write a synthetic catalog as JSONL" if name == "generate" else "import a synthetic catalog")
+        cmd.add_argument("count", type=int)
+        cmd.add_argument("--instructors", type=int, default=100)
+        cmd.add_argument("--seed", type=int, default=0)
+        cmd.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+        if name == "generate":
+            cmd.add_argument("--output", default="-")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+        try:
+            for _, row in generate_courses(args.count, args.instructors, args.seed):
+                out.write(orjson.dumps(row) + b"\n")
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+        return None
+
+    if args.command == "import":
+        with open(args.path, newline="", encoding="utf-8") as f:
+            return await import_rows(iter_rows(f, detect_format(args.path)), args.batch_size)
+    return await import_rows(generate_courses(args.count, args.instructors, args.seed), args.batch_size)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    report = asyncio.run(main())
+    if report is not None:
+        print(orjson.dumps(report, option=orjson.OPT_INDENT_2).decode())
@@ -0,0 +1,43 @@
+from datetime import datetime
+from typing import List
+from pydantic import BaseModel, Field, model_validator
+import ingest
+import instructors
+import ratings
+import storage
+
+
+class CourseCreate(BaseModel):
+    title: str = Field(..., min_length=1, max_length=100)
+    description: str = Field(..., min_length=10)
+    difficulty: str = Field(..., pattern="^(beginner|intermediate|advanced)$")
+    price: float = Field(..., ge=0)
+    ratings: float = Field(..., ge=0, le=5)
+    video_urls: List[str] = Field(..., min_items=1)
+
+    @model_validator(mode='after')
+    def validate_video_urls(self) -> 'CourseCreate':
+        if not self.video_urls:
+            raise ValueError('At least one video URL is required')
+        
+        # Check if URLs come from the configured storage backend (or are
+        # references to uploads still being ingested)
+        for url in self.video_urls:
+            if not url.startswith(storage.backend.url_prefix) and not ingest.is_pending_ref(url):
+                raise ValueError(f'Invalid video URL: {url}. Must start with {storage.backend.url_prefix}')
+        return self
+
+
+def course_document(course: CourseCreate, instructor: str, is_verified: bool = False,
+                    video_urls: list = None, pending: list = None) -> dict:
+    """The document stored for a validated course"""
+    course_dict = course.dict()
+    course_dict["video_urls"] = video_urls if video_urls is not None else course.video_urls
+    course_dict["pending_uploads"] = pending or []
+    course_dict["instructor"] = instructor
+    course_dict["instructor_info"] = instructors.instructor_info(instructor, is_verified)
+    course_dict["rating"] = course.ratings
+    # Review aggregates start at zero, ready for ratings.apply_review_change
+    course_dict.update(ratings.empty_aggregate())
+    course_dict["created_at"] = datetime.utcnow().isoformat()
+    return course_dict
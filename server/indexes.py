@@ -0,0 +1,149 @@
+import os
+import logging
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Plans slower than this (or doing a collection scan) are reported
+SLOW_PLAN_MS = int(os.getenv("INDEX_SLOW_PLAN_MS", "100"))
+
+# Declarative index registry: collection name -> indexes the app relies on
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("role", ASCENDING), ("username", ASCENDING)], name="role_username"),
+    ],
+    "courses": [
+        IndexModel([("instructor", ASCENDING)], name="instructor"),
+        IndexModel([("difficulty", ASCENDING), ("_id", ASCENDING)], name="difficulty_id"),
+        IndexModel([("rating", DESCENDING), ("_id", DESCENDING)], name="rating_id"),
+        IndexModel([("price", ASCENDING), ("_id", ASCENDING)], name="price_id"),
+        IndexModel([("title", ASCENDING), ("_id", ASCENDING)], name="title_id"),
+        IndexModel(
+            [("external_id", ASCENDING)],
+            name="external_id_unique",
+            unique=True,
+            partialFilterExpression={"external_id": {"$exists": True}},
+        ),
+        IndexModel(
+            [("title", TEXT), ("description", TEXT)],
+            name="title_description_text",
+            weights={"title": 10, "description": 2},
+        ),
+    ],
+    "reviews": [
+        IndexModel([("course_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="course_created_at_id"),
+        IndexModel([("course_id", ASCENDING), ("user_id", ASCENDING)], name="course_user_unique", unique=True),
+    ],
+    "purchases": [
+        IndexModel([("user_id", ASCENDING), ("course_id", ASCENDING)], name="user_course_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("purchase_date", DESCENDING), ("_id", DESCENDING)], name="user_date"),
+        IndexModel([("course_id", ASCENDING), ("purchase_date", DESCENDING), ("_id", DESCENDING)], name="course_date"),
+    ],
+    "jobs": [
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at"),
+    ],
+}
+
+# Hot query shapes checked with explain(): (collection, filter, sort)
+HOT_QUERIES = [
+    ("users", {"email": "probe@example.com"}, None),
+    ("users", {"username": "probe"}, None),
+    ("users", {"role": "instructor", "username": {"$in": ["probe"]}}, None),
+    ("courses", {"instructor": "probe"}, None),
+    ("courses", {"difficulty": "beginner"}, [("_id", ASCENDING)]),
+    ("courses", {"rating": {"$gte": 4}}, [("rating", DESCENDING), ("_id", DESCENDING)]),
+    ("courses", {"$text": {"$search": "probe"}}, None),
+    ("reviews", {"course_id": "probe"}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ("reviews", {"course_id": "probe", "user_id": "probe"}, None),
+    ("purchases", {"user_id": "probe", "course_id": "probe"}, None),
+    ("purchases", {"user_id": "probe"}, [("purchase_date", DESCENDING), ("_id", DESCENDING)]),
+    ("purchases", {"course_id": "probe"}, [("purchase_date", DESCENDING), ("_id", DESCENDING)]),
+    ("jobs", {"status": "queued"}, [("created_at", ASCENDING)]),
+]
+
+
+async def ensure_indexes(db):
+    """Create every index in the registry. Failures are logged, not raised."""
+    for collection_name, models in INDEXES.items():
+        try:
+            created = await db[collection_name].create_indexes(models)
+            logger.info(f"Indexes ensured on {collection_name}: {', '.join(created)}")
+        except OperationFailure as e:
+            # e.g. duplicate emails/usernames prevent building a unique index
+            logger.error(f"Failed to create indexes on {collection_name}: {str(e)}")
+
+
+async def find_missing_indexes(db):
+    """Return {collection: [index names]} for registry indexes that do not exist"""
+    missing = {}
+    for collection_name, models in INDEXES.items():
+        existing = await db[collection_name].index_information()
+        existing_keys = {tuple(info["key"]) for info in existing.values()}
+        for model in models:
+            spec = model.document
+            if spec["name"] not in existing and tuple(spec["key"].items()) not in existing_keys:
+                missing.setdefault(collection_name, []).append(spec["name"])
+    return missing
+
+
+def plan_stages(plan):
+    """Yield every stage name in a (possibly nested) query plan"""
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from plan_stages(child)
+
+
+async def explain_hot_queries(db):
+    """Run explain() on the hot query shapes and return the problematic ones"""
+    report = []
+    for collection_name, query, sort in HOT_QUERIES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            explain = await cursor.limit(20).explain()
+        except Exception as e:
+            logger.error(f"explain() failed on {collection_name} {query}: {str(e)}")
+            continue
+
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        stages = list(plan_stages(winning_plan))
+        stats = explain.get("executionStats", {})
+        entry = {
+            "collection": collection_name,
+            "filter": sorted(query),
+            "sort": [field for field, _ in sort] if sort else [],
+            "stages": stages,
+            "collection_scan": "COLLSCAN" in stages,
+            "in_memory_sort": "SORT" in stages,
+            "execution_ms": stats.get("executionTimeMillis"),
+            "docs_examined": stats.get("totalDocsExamined"),
+            "returned": stats.get("nReturned"),
+        }
+        if entry["collection_scan"] or entry["in_memory_sort"] or (entry["execution_ms"] or 0) > SLOW_PLAN_MS:
+            report.append(entry)
+    return report
+
+
+async def verify_indexes(db):
+    """Log missing indexes and slow plans; returns the combined report"""
+    missing = await find_missing_indexes(db)
+    for collection_name, names in missing.items():
+        logger.warning(f"Missing indexes on {collection_name}: {', '.join(names)}")
+
+    slow_plans = await explain_hot_queries(db)
+    for entry in slow_plans:
+        logger.warning(
+            f"Slow query plan on {entry['collection']} filter={entry['filter']} sort={entry['sort']}: "
+            f"stages={entry['stages']} time={entry['execution_ms']}ms examined={entry['docs_examined']}"
+        )
+    return {"missing_indexes": missing, "slow_plans": slow_plans}
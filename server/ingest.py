@@ -0,0 +1,253 @@
+import os
+import re
+import uuid
+import shutil
+import asyncio
+import logging
+import urllib.request
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+from db import courses_collection
+import jobs
+import cache
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Where accepted uploads wait for an ingest worker (must be shared with standalone workers)
+UPLOAD_STAGING_DIR = os.getenv("UPLOAD_STAGING_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "staging"))
+# Check that a stored video is actually reachable before handing out its URL
+INGEST_VERIFY_URLS = os.getenv("INGEST_VERIFY_URLS", "true" if storage.STORAGE_BACKEND == "cloudinary" else "false").lower() == "true"
+
+# Courses may list "job:<id>" in video_urls for uploads that are still being ingested
+PENDING_PREFIX = "job:"
+PENDING_RE = re.compile(r"^job:([0-9a-f]{24})$")
+
+
+def pending_ref(job_id) -> str:
+    return f"{PENDING_PREFIX}{job_id}"
+
+
+def is_pending_ref(url: str) -> bool:
+    return bool(PENDING_RE.match(url))
+
+
+class MultipartStager:
+    """python-multipart callbacks collecting the file part of a form; its
+    data is queued per body chunk and written by stage_multipart"""
+
+    def __init__(self, field_name: str):
+        self.field_name = field_name
+        self.filename = None
+        self.headers = {}
+        self.header = [b"", b""]
+        self.in_file = False
+        self.found = False
+        self.pending = []
+
+    def on_part_begin(self):
+        self.headers = {}
+        self.in_file = False
+
+    def on_header_field(self, data, start, end):
+        self.header[0] += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self.header[1] += data[start:end]
+
+    def on_header_end(self):
+        self.headers[self.header[0].lower()] = self.header[1]
+        self.header = [b"", b""]
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self.headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        if name == self.field_name and b"filename" in options and not self.found:
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+            self.in_file = self.found = True
+
+    def on_part_data(self, data, start, end):
+        if self.in_file:
+            self.pending.append(data[start:end])
+
+    def on_part_end(self):
+        self.in_file = False
+
+    def callbacks(self) -> dict:
+        return {name: getattr(self, name) for name in (
+            "on_part_begin", "on_header_field", "on_header_value", "on_header_end",
+            "on_headers_finished", "on_part_data", "on_part_end",
+        )}
+
+
+async def stage_multipart(request, field_name: str = "file") -> tuple:
+    """Parse a multipart/form-data body as it arrives and write the file part
+    straight to the staging directory, so the upload hits the disk once (no
+    spooled temporary file to copy). Returns (path, filename, size); the
+    partial file is removed if anything fails."""
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    if b"boundary" not in params:
+        raise storage.UploadError("Expected a multipart/form-data upload")
+    os.makedirs(UPLOAD_STAGING_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_STAGING_DIR, f"{uuid.uuid4().hex}_upload")
+    stager = MultipartStager(field_name)
+    parser = MultipartParser(params[b"boundary"], stager.callbacks())
+    size = 0
+    f = await asyncio.to_thread(open, path, "wb")
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if stager.pending:
+                data = b"".join(stager.pending)
+                stager.pending.clear()
+                size += len(data)
+                if size > storage.MAX_UPLOAD_SIZE:
+                    raise storage.UploadError(f"Upload is larger than {storage.MAX_UPLOAD_SIZE} bytes")
+                await asyncio.to_thread(f.write, data)
+        parser.finalize()
+        if not stager.found:
+            raise storage.UploadError(f"No file in the '{field_name}' form field")
+        if size == 0:
+            raise storage.UploadError("Uploaded file is empty")
+    except BaseException:
+        f.close()
+        await asyncio.to_thread(remove_staged, path)
+        raise
+    await asyncio.to_thread(f.close)
+    return path, stager.filename, size
+
+
+def remove_staged(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+async def iter_staged(path: str, chunk_size: int = storage.UPLOAD_READ_CHUNK_SIZE):
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        while True:
+            data = await asyncio.to_thread(f.read, chunk_size)
+            if not data:
+                break
+            yield data
+    finally:
+        f.close()
+
+
+async def probe_duration(path: str):
+    """Video duration in seconds via ffprobe, or None when it is not installed"""
+    ffprobe = shutil.which("ffprobe")
+    if not ffprobe:
+        return None
+    proc = await asyncio.create_subprocess_exec(
+        ffprobe, "-v", "error", "-show_entries", "format=duration", "-of", "default=nw=1:nk=1", path,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+    out, _ = await proc.communicate()
+    try:
+        return round(float(out.decode().strip()), 2)
+    except ValueError:
+        return None
+
+
+def check_url(url: str):
+    request = urllib.request.Request(url, method="HEAD")
+    with urllib.request.urlopen(request, timeout=10) as response:
+        if response.status >= 400:
+            raise storage.UploadError(f"Stored video is not reachable: {url} ({response.status})")
+
+
+async def validate_video_url(url: str):
+    if not url.startswith(storage.backend.url_prefix):
+        raise storage.UploadError(f"Storage returned an unexpected URL: {url}")
+    if INGEST_VERIFY_URLS:
+        await asyncio.to_thread(check_url, url)
+
+
+async def resolve_pending_refs(job: dict):
+    """Swap a finished job's reference in courses for the video URL, or drop
+    the reference when ingestion failed"""
+    ref = pending_ref(job["_id"])
+    if job["status"] == "done":
+        await courses_collection.update_many(
+            {"video_urls": ref},
+            {"$set": {"video_urls.$[ref]": job["result"]["video_url"]}, "$pull": {"pending_uploads": ref}},
+            array_filters=[{"ref": ref}]
+        )
+    elif job["status"] == "failed":
+        await courses_collection.update_many(
+            {"video_urls": ref},
+            {"$pull": {"video_urls": ref, "pending_uploads": ref}}
+        )
+    else:
+        return
+    await cache.invalidate_course()
+
+
+@jobs.register("video_ingest", finalize=resolve_pending_refs)
+async def ingest_video(job: dict):
+    """Transfer a staged upload to storage, then extract metadata and validate the URL"""
+    payload = job["payload"]
+    path = payload["path"]
+    if not os.path.exists(path):
+        raise storage.UploadError("Staged upload is missing")
+    try:
+        # Wait for a transfer slot: failing the job on UploadBusy would lose
+        # an upload that was already accepted
+        video_url = await storage.uploads.upload_stream(
+            job["owner"], payload["filename"], payload["size"], iter_staged(path), wait=True
+        )
+        duration = await probe_duration(path)
+        await validate_video_url(video_url)
+    finally:
+        await asyncio.to_thread(remove_staged, path)
+
+    return {
+        "video_url": video_url,
+        "thumbnail_url": storage.backend.thumbnail_url(video_url),
+        "duration": duration,
+        "title": payload["filename"],
+    }
+
+
+async def enqueue_upload(owner: str, request) -> dict:
+    """Stage the video of a multipart request and queue its ingestion"""
+    path, filename, size = await stage_multipart(request)
+    try:
+        return await jobs.enqueue("video_ingest", owner, {"path": path, "filename": filename, "size": size})
+    except BaseException:
+        await asyncio.to_thread(remove_staged, path)
+        raise
+
+
+async def check_pending_refs(owner: str, urls: list):
+    """Validate the job references of a new course. Returns (video_urls, pending):
+    finished jobs are replaced by their URL, running ones are kept as references.
+    Raises ValueError for unknown, foreign or failed jobs."""
+    video_urls, pending = [], []
+    for url in urls:
+        if not is_pending_ref(url):
+            video_urls.append(url)
+            continue
+        job = await jobs.get_job(PENDING_RE.match(url).group(1))
+        if not job or job["kind"] != "video_ingest" or job["owner"] != owner:
+            raise ValueError(f"Unknown upload: {url}")
+        if job["status"] == "failed":
+            raise ValueError(f"Upload failed: {job.get('error')}")
+        if job["status"] == "done":
+            video_urls.append(job["result"]["video_url"])
+        else:
+            video_urls.append(url)
+            pending.append(url)
+    return video_urls, pending
+
+
+async def settle_pending_refs(pending: list):
+    """Resolve references of jobs that finished while the course was being
+    inserted (their finalize step may have run before the course existed)"""
+    for ref in pending:
+        job = await jobs.get_job(PENDING_RE.match(ref).group(1))
+        if job and job["status"] in ("done", "failed"):
+            await resolve_pending_refs(job)
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from pymongo import UpdateMany
+from pymongo.errors import OperationFailure
+from db import courses_collection, reviews_collection, users_collection
+
+logger = logging.getLogger(__name__)
+
+
+def instructor_info(username: str, is_verified: bool = False) -> dict:
+    """Instructor display fields stored on each of their courses"""
+    return {"username": username, "isVerified": bool(is_verified)}
+
+
+def course_instructor(course: dict) -> dict:
+    """The denormalized instructor of a course (courses not yet backfilled
+    read as unverified)"""
+    return course.get("instructor_info") or instructor_info(course.get("instructor"))
+
+
+async def sync_instructor_courses(username: str, is_verified: bool) -> int:
+    """Fan a changed instructor out to all of their courses; returns how many changed"""
+    result = await courses_collection.update_many(
+        {"instructor": username},
+        {"$set": {"instructor_info": instructor_info(username, is_verified)}}
+    )
+    logger.info(f"Updated instructor fields of {result.modified_count} courses of {username}")
+    return result.modified_count
+
+
+def instructor_fields_pipeline() -> list:
+    """Courses grouped by instructor and stored instructor_info, each group
+    with its instructor's user document (role and verification only)"""
+    return [
+        {"$group": {
+            "_id": {"instructor": "$instructor", "info": "$instructor_info"},
+            "courses": {"$sum": 1},
+        }},
+        {"$lookup": {
+            "from": users_collection.name,
+            "localField": "_id.instructor",
+            "foreignField": "username",
+            "as": "user",
+        }},
+        {"$project": {"courses": 1, "user.role": 1, "user.isVerified": 1}},
+    ]
+
+
+async def check_instructor_fields(repair: bool = False):
+    """Compare the instructor fields stored on courses with the users
+    collection in one aggregation. Returns {"instructors": n, "drifted":
+    courses out of date} and with repair=True rewrites the drifted courses."""
+    cursor = await courses_collection.aggregate(instructor_fields_pipeline())
+    groups = await cursor.to_list(length=None)
+
+    # Courses of unknown instructors are expected to read as unverified
+    instructors, drifted, expected_by_instructor = set(), 0, {}
+    for group in groups:
+        username = group["_id"].get("instructor")
+        user = next((user for user in group.get("user", []) if user.get("role") == "instructor"), {})
+        expected = instructor_info(username, user.get("isVerified", False))
+        instructors.add(username)
+        # Compared like the server does: key order matters
+        stored = group["_id"].get("info")
+        if not isinstance(stored, dict) or list(stored.items()) != list(expected.items()):
+            drifted += group["courses"]
+            expected_by_instructor[username] = expected
+
+    repaired = 0
+    if repair and drifted:
+        operations = [
+            UpdateMany({"instructor": username, "instructor_info": {"$ne": expected}},
+                       {"$set": {"instructor_info": expected}})
+            for username, expected in expected_by_instructor.items()
+        ]
+        result = await courses_collection.bulk_write(operations, ordered=False)
+        repaired = result.modified_count
+        logger.info(f"Repaired instructor fields on {repaired} courses")
+    elif drifted:
+        logger.warning(f"{drifted} courses have out of date instructor fields")
+
+    return {"instructors": len(instructors), "drifted": drifted, "repaired": repaired}
+
+
+# Review fields shown on the instructor dashboard
+DASHBOARD_REVIEW_FIELDS = {"course_id": 1, "user_id": 1, "username": 1, "rating": 1, "comment": 1, "created_at": 1}
+
+# Server errors meaning the pipeline itself is not supported (servers before
+# 4.2 without $round): InvalidPipelineOperator and unrecognized stage name
+PIPELINE_UNSUPPORTED_CODES = {168, 40324}
+
+
+def dashboard_pipeline(username: str, reviews_limit: int) -> list:
+    """The instructor's courses, their stored rating aggregates and the latest
+    reviews of each course in one aggregation ($lookup with let: MongoDB 3.6+,
+    $round: 4.2+)"""
+    pipeline = [{"$match": {"instructor": username}}]
+    if reviews_limit > 0:
+        pipeline.append({"$lookup": {
+            "from": reviews_collection.name,
+            "let": {"course_id": {"$toString": "$_id"}},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$course_id", "$$course_id"]}}},
+                {"$sort": {"created_at": -1, "_id": -1}},
+                {"$limit": reviews_limit},
+                {"$project": DASHBOARD_REVIEW_FIELDS},
+            ],
+            "as": "reviews"
+        }})
+    else:
+        pipeline.append({"$addFields": {"reviews": []}})
+    pipeline.append({"$addFields": {
+        "review_count": {"$ifNull": ["$rating_count", 0]},
+        "average_rating": {"$cond": [
+            {"$gt": [{"$ifNull": ["$rating_count", 0]}, 0]},
+            {"$round": [{"$divide": ["$rating_sum", "$rating_count"]}, 2]},
+            None
+        ]},
+    }})
+    return pipeline
+
+
+async def dashboard_courses_fallback(username: str, reviews_limit: int) -> list:
+    """Same result as dashboard_pipeline from plain queries: the courses, then
+    the latest reviews of each course (served by the course_created_at_id index)"""
+    courses = await courses_collection.find({"instructor": username}).to_list(length=None)
+
+    async def latest_reviews(course):
+        if reviews_limit <= 0:
+            return []
+        cursor = reviews_collection.find({"course_id": str(course["_id"])}, DASHBOARD_REVIEW_FIELDS)
+        return await cursor.sort([("created_at", -1), ("_id", -1)]).limit(reviews_limit).to_list(length=None)
+
+    for course, reviews in zip(courses, await asyncio.gather(*(latest_reviews(course) for course in courses))):
+        count = course.get("rating_count") or 0
+        course["reviews"] = reviews
+        course["review_count"] = count
+        course["average_rating"] = round(course.get("rating_sum", 0) / count, 2) if count else None
+    return courses
+
+
+async def dashboard_courses(username: str, reviews_limit: int) -> list:
+    """Courses of an instructor for the dashboard. Each course document gets
+    `reviews` (latest first, DASHBOARD_REVIEW_FIELDS plus _id), `review_count`
+    and `average_rating` (None without reviews)."""
+    try:
+        pipeline = dashboard_pipeline(username, reviews_limit)
+        return await (await courses_collection.aggregate(pipeline)).to_list(length=None)
+    except OperationFailure as e:
+        # Anything else (timeouts, elections, interrupts) is not a reason to
+        # fall back to one reviews query per course
+        if e.code not in PIPELINE_UNSUPPORTED_CODES:
+            raise
+        logger.warning(f"Instructor dashboard pipeline not supported, using plain queries: {e}")
+    return await dashboard_courses_fallback(username, reviews_limit)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    report = asyncio.run(check_instructor_fields(repair=True))
+    print(f"Repaired instructor fields on {report['repaired']} courses.")
@@ -0,0 +1,215 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from db import jobs_collection
+
+logger = logging.getLogger(__name__)
+
+# Workers started inside each API process (0 = only enqueue, run `python jobs.py` instead)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# How often idle workers look for jobs queued by other processes
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+# Running jobs refresh locked_at this often (seconds) while their handler works
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "60"))
+# Running jobs whose locked_at is older than this are assumed lost (e.g. the worker died)
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "600"))
+# How often the workers look for stale jobs (seconds)
+JOB_REQUEUE_INTERVAL = float(os.getenv("JOB_REQUEUE_INTERVAL", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# kind -> (handler, finalize)
+_handlers = {}
+_tasks = []
+_wakeup = None
+# When the workers of this process last ran requeue_stale (monotonic)
+_requeued_at = 0.0
+
+
+def register(kind: str, finalize=None):
+    """Register the coroutine running jobs of this kind. Its return value is
+    stored as the job result. finalize(job) runs after the final status is saved."""
+    def decorator(handler):
+        _handlers[kind] = (handler, finalize)
+        return handler
+    return decorator
+
+
+def public_job(job: dict) -> dict:
+    """The fields of a job exposed to its owner"""
+    return {
+        "_id": job["_id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "attempts": job.get("attempts", 0),
+        "created_at": job["created_at"],
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at"),
+    }
+
+
+async def enqueue(kind: str, owner: str, payload: dict) -> dict:
+    job = {
+        "kind": kind,
+        "owner": owner,
+        "payload": payload,
+        "status": "queued",
+        "attempts": 0,
+        "created_at": datetime.utcnow(),
+    }
+    result = await jobs_collection.insert_one(job)
+    job["_id"] = result.inserted_id
+    if _wakeup is not None:
+        _wakeup.set()
+    return job
+
+
+async def get_job(job_id: str):
+    if not ObjectId.is_valid(job_id):
+        return None
+    return await jobs_collection.find_one({"_id": ObjectId(job_id)})
+
+
+async def claim_next():
+    """Atomically move the oldest queued job to running, so every job is run by
+    exactly one worker even with several processes polling"""
+    now = datetime.utcnow()
+    return await jobs_collection.find_one_and_update(
+        {"status": "queued"},
+        {"$set": {"status": "running", "started_at": now, "locked_at": now}, "$inc": {"attempts": 1}},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def heartbeat(job_id, interval: float = JOB_HEARTBEAT_INTERVAL):
+    """Keep refreshing locked_at of a running job, so requeue_stale leaves
+    long jobs (multi-GB transfers) alone while their worker is alive"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await jobs_collection.update_one(
+                {"_id": job_id, "status": "running"}, {"$set": {"locked_at": datetime.utcnow()}}
+            )
+        except Exception as e:
+            logger.error(f"Heartbeat of job {job_id} failed: {str(e)}")
+
+
+async def run_job(job: dict):
+    handler, finalize = _handlers.get(job["kind"], (None, None))
+    update = {"finished_at": datetime.utcnow()}
+    if handler is None:
+        update.update(status="failed", error=f"Unknown job kind: {job['kind']}")
+    else:
+        beat = asyncio.create_task(heartbeat(job["_id"]))
+        try:
+            update.update(status="done", result=await handler(job))
+        except Exception as e:
+            logger.error(f"Job {job['_id']} ({job['kind']}) failed: {str(e)}")
+            update.update(status="failed", error=str(e))
+        finally:
+            beat.cancel()
+        update["finished_at"] = datetime.utcnow()
+
+    await jobs_collection.update_one({"_id": job["_id"]}, {"$set": update})
+    job.update(update)
+    logger.info(f"Job {job['_id']} ({job['kind']}) {job['status']}")
+
+    if finalize:
+        try:
+            await finalize(job)
+        except Exception as e:
+            logger.error(f"Finalizing job {job['_id']} failed: {str(e)}")
+
+
+async def requeue_stale():
+    """Put jobs abandoned by a dead worker back in the queue, or fail them once
+    they used up their attempts"""
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+    stale = {"status": "running", "$or": [
+        {"locked_at": {"$lt": cutoff}},
+        # jobs claimed before locked_at existed
+        {"locked_at": {"$exists": False}, "started_at": {"$lt": cutoff}},
+    ]}
+    failed = await jobs_collection.update_many(
+        {**stale, "attempts": {"$gte": JOB_MAX_ATTEMPTS}},
+        {"$set": {"status": "failed", "error": "Job was abandoned too many times", "finished_at": datetime.utcnow()}}
+    )
+    requeued = await jobs_collection.update_many(stale, {"$set": {"status": "queued"}})
+    if failed.modified_count or requeued.modified_count:
+        logger.warning(f"Requeued {requeued.modified_count} stale jobs, failed {failed.modified_count}")
+
+
+async def _requeue_if_due():
+    """requeue_stale at most once per JOB_REQUEUE_INTERVAL across the workers,
+    so jobs of a worker that died are picked up without a restart"""
+    global _requeued_at
+    if time.monotonic() - _requeued_at < JOB_REQUEUE_INTERVAL:
+        return
+    _requeued_at = time.monotonic()
+    try:
+        await requeue_stale()
+    except Exception as e:
+        logger.error(f"Could not requeue stale jobs: {str(e)}")
+
+
+async def _worker(n: int):
+    while True:
+        await _requeue_if_due()
+        try:
+            job = await claim_next()
+        except Exception as e:
+            logger.error(f"Job worker {n} could not claim a job: {str(e)}")
+            job = None
+
+        if job is None:
+            _wakeup.clear()
+            try:
+                await asyncio.wait_for(_wakeup.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await run_job(job)
+
+
+async def start_workers(count: int = JOB_WORKERS):
+    global _wakeup, _requeued_at
+    _wakeup = asyncio.Event()
+    if count <= 0:
+        return
+    _requeued_at = 0.0
+    await _requeue_if_due()
+    _tasks.extend(asyncio.create_task(_worker(n)) for n in range(count))
+    logger.info(f"Started {count} job workers")
+
+
+async def stop_workers():
+    """Cancel the workers; jobs they were running are picked up again by
+    requeue_stale on the next start"""
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+
+
+async def run_forever(count: int):
+    import db
+    import ingest  # noqa: F401 (registers the ingestion handlers)
+
+    await db.connect()
+    await start_workers(count)
+    try:
+        await asyncio.gather(*_tasks)
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    # Standalone ingest worker, scaled independently of the API processes
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_forever(max(JOB_WORKERS, 1)))
@@ -0,0 +1,240 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Seconds between event loop lag probes
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.5"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A counter or gauge with a fixed set of label names"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, value: float, *labels):
+        """Set a value; for counters mirrored from stats kept elsewhere"""
+        with self._lock:
+            self._values[labels] = value
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_labels(self.label_names, labels)} {_number(value)}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, {**series, "counts": list(series["counts"])}) for labels, series in self._values.items()]
+        for labels, series in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                yield f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_labels(self.label_names, labels, le)} {series['count']}"
+            yield f"{self.name}_sum{_labels(self.label_names, labels)} {_number(series['sum'])}"
+            yield f"{self.name}_count{_labels(self.label_names, labels)} {series['count']}"
+
+
+REGISTRY = []
+# Callables run before each scrape to copy stats kept by other modules into metrics
+COLLECTORS = []
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+HTTP_IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests being handled")
+
+MONGO_LATENCY = Histogram("mongo_command_duration_seconds", "MongoDB command latency",
+                          ("collection", "command"), MONGO_BUCKETS)
+MONGO_FAILURES = Counter("mongo_command_failures_total", "Failed MongoDB commands", ("collection", "command"))
+
+BCRYPT_QUEUE = Histogram("bcrypt_queue_seconds", "Time password jobs waited for a bcrypt worker")
+BCRYPT_RUN = Histogram("bcrypt_run_seconds", "Time spent hashing or verifying a password")
+BCRYPT_IN_FLIGHT = Gauge("bcrypt_jobs_in_flight", "Password jobs running or waiting for a worker")
+BCRYPT_REJECTED = Counter("bcrypt_jobs_rejected_total", "Password jobs rejected because the queue was full")
+
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by result", ("cache", "namespace", "result"))
+CACHE_HIT_RATIO = Gauge("cache_hit_ratio", "Share of cache lookups that were hits", ("cache", "namespace"))
+
+RATE_LIMITED = Counter("rate_limited_total", "Requests refused by a rate limit", ("limit",))
+ADMISSION_REJECTED = Counter("admission_rejected_total", "Requests refused at a concurrency limit", ("route_class",))
+
+EVENT_LOOP_LAG = Histogram("event_loop_lag_seconds", "Delay of the event loop waking a sleeping task")
+
+
+def collector(func):
+    """Register a function refreshing metrics at scrape time"""
+    COLLECTORS.append(func)
+    return func
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    for func in COLLECTORS:
+        try:
+            func()
+        except Exception as e:
+            logger.error(f"Metrics collector {func.__name__} failed: {e}")
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+def command_collection(event) -> str:
+    """Collection a command targets ("" for database/admin commands)"""
+    if event.command_name == "getMore":
+        return event.command.get("collection", "")
+    target = event.command.get(event.command_name)
+    return target if isinstance(target, str) else ""
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Times every MongoDB command by collection and command name"""
+
+    def __init__(self):
+        self._started = {}
+
+    def started(self, event):
+        self._started[(event.connection_id, event.request_id)] = command_collection(event)
+
+    def succeeded(self, event):
+        collection = self._started.pop((event.connection_id, event.request_id), "")
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, collection, event.command_name)
+
+    def failed(self, event):
+        collection = self._started.pop((event.connection_id, event.request_id), "")
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, collection, event.command_name)
+        MONGO_FAILURES.inc(collection, event.command_name)
+
+
+mongo_listener = MongoCommandListener()
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware counting requests and timing them per route
+    template (/courses/{course_id}), so ids do not blow up label cardinality"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.perf_counter()
+        info = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                info["status"] = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_PROGRESS.inc(amount=-1)
+            # FastAPI stores the matched route in the scope
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUESTS.inc(scope["method"], route, str(info["status"]))
+            HTTP_LATENCY.observe(time.perf_counter() - started_at, scope["method"], route)
+
+
+async def monitor_event_loop(interval: float = EVENT_LOOP_LAG_INTERVAL):
+    """Measure how late the loop wakes a task sleeping for interval seconds"""
+    while True:
+        started_at = time.perf_counter()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, time.perf_counter() - started_at - interval))
+
+
+_loop_monitor = None
+
+
+def start_loop_monitor():
+    global _loop_monitor
+    if _loop_monitor is None:
+        _loop_monitor = asyncio.create_task(monitor_event_loop())
+
+
+async def stop_loop_monitor():
+    global _loop_monitor
+    if _loop_monitor is not None:
+        _loop_monitor.cancel()
+        try:
+            await _loop_monitor
+        except asyncio.CancelledError:
+            pass
+        _loop_monitor = None
@@ -0,0 +1,110 @@
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from passlib.context import CryptContext
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# bcrypt cost factor; raising it makes existing hashes get upgraded on login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Threads doing bcrypt work (bcrypt releases the GIL while hashing)
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Jobs allowed to wait for a worker before new ones are rejected
+PASSWORD_MAX_QUEUE = int(os.getenv("PASSWORD_MAX_QUEUE", "64"))
+
+# Password hashing setup
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="bcrypt")
+
+
+class PasswordQueueFull(Exception):
+    """Raised when too many password jobs are already waiting"""
+
+
+class PasswordPoolStats:
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.queue_seconds = 0.0
+        self.run_seconds = 0.0
+
+    def as_dict(self):
+        completed = self.completed or 1
+        return {
+            "workers": PASSWORD_WORKERS,
+            "max_queue": PASSWORD_MAX_QUEUE,
+            "rounds": BCRYPT_ROUNDS,
+            "in_flight": self.in_flight,
+            "queued": max(0, self.in_flight - PASSWORD_WORKERS),
+            "max_in_flight": self.max_in_flight,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_queue_ms": round(self.queue_seconds / completed * 1000, 2),
+            "avg_run_ms": round(self.run_seconds / completed * 1000, 2),
+        }
+
+
+stats = PasswordPoolStats()
+
+
+async def _run(func, *args):
+    """Run a bcrypt call on the bounded pool, recording queue and run time"""
+    if stats.in_flight - PASSWORD_WORKERS >= PASSWORD_MAX_QUEUE:
+        stats.rejected += 1
+        raise PasswordQueueFull("Too many password operations in progress")
+
+    stats.in_flight += 1
+    stats.submitted += 1
+    stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+    enqueued_at = time.perf_counter()
+
+    def timed():
+        started_at = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            run_seconds = time.perf_counter() - started_at
+            stats.queue_seconds += started_at - enqueued_at
+            stats.run_seconds += run_seconds
+            metrics.BCRYPT_QUEUE.observe(started_at - enqueued_at)
+            metrics.BCRYPT_RUN.observe(run_seconds)
+
+    loop = asyncio.get_running_loop()
+
+    def finished():
+        stats.in_flight -= 1
+        stats.completed += 1
+
+    def done(future):
+        # Runs when the job finished or was cancelled before it started, not
+        # when the awaiting request is cancelled while bcrypt still runs
+        try:
+            loop.call_soon_threadsafe(finished)
+        except RuntimeError:
+            pass  # loop already closed
+
+    future = _executor.submit(timed)
+    future.add_done_callback(done)
+    return await asyncio.wrap_future(future)
+
+
+async def get_password_hash(password: str) -> str:
+    return await _run(pwd_context.hash, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str):
+    """Check a password; returns (valid, new_hash) where new_hash is set when
+    the stored hash should be replaced (e.g. BCRYPT_ROUNDS was raised)"""
+    return await _run(pwd_context.verify_and_update, plain_password, hashed_password)
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,228 @@
+import os
+import time
+import pstats
+import random
+import asyncio
+import cProfile
+import logging
+import contextvars
+from datetime import datetime
+import orjson
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Fraction of requests profiled without being asked to (0 disables sampling)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Profiles kept on disk; the oldest are deleted past this
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "100"))
+# Functions listed in a profile summary
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "40"))
+
+# Header asking for a profile of one request; its value must be the admin token
+PROFILE_HEADER = b"x-profile"
+
+# Timings of the request being profiled, visible to the code it calls
+current = contextvars.ContextVar("profile", default=None)
+
+
+class RequestTimings:
+    """Time spent in Mongo commands and response serialization by one request"""
+
+    def __init__(self):
+        self.mongo_seconds = 0.0
+        self.mongo_commands = 0
+        self.serialization_seconds = 0.0
+
+
+def timed_serialization(func, *args):
+    """Call a serializer, charging its time to the request being profiled"""
+    timings = current.get()
+    if timings is None:
+        return func(*args)
+    started_at = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        timings.serialization_seconds += time.perf_counter() - started_at
+
+
+class ProfileCommandListener(monitoring.CommandListener):
+    """Adds Mongo command time to the request being profiled. The async
+    driver publishes events from the calling task, so the context is the request's."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._charge(event)
+
+    def failed(self, event):
+        self._charge(event)
+
+    def _charge(self, event):
+        timings = current.get()
+        if timings is not None:
+            timings.mongo_seconds += event.duration_micros / 1e6
+            timings.mongo_commands += 1
+
+
+mongo_listener = ProfileCommandListener()
+
+
+def top_functions(profiler: cProfile.Profile, limit: int = PROFILE_TOP) -> list:
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {
+            "function": f"{os.path.basename(filename)}:{line}({name})" if line else name,
+            "calls": calls,
+            "tottime_ms": round(tottime * 1000, 3),
+            "cumtime_ms": round(cumtime * 1000, 3),
+        }
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in rows
+    ]
+
+
+def safe_profile_id(profile_id: str) -> bool:
+    return bool(profile_id) and all(c.isalnum() or c == "-" for c in profile_id)
+
+
+def save_profile(summary: dict, profiler: cProfile.Profile):
+    """Write <id>.json and the raw <id>.prof, then drop the oldest profiles.
+    The .prof file opens in snakeviz or flameprof for a flame graph."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, summary["id"])
+    profiler.dump_stats(base + ".prof")
+    with open(base + ".json", "wb") as f:
+        f.write(orjson.dumps(summary))
+
+    summaries = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith(".json"))
+    for name in summaries[:max(0, len(summaries) - PROFILE_KEEP)]:
+        for path in (name, name[:-len(".json")] + ".prof"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, path))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles() -> list:
+    """Summaries without the function list, newest first"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted((n for n in os.listdir(PROFILE_DIR) if n.endswith(".json")), reverse=True):
+        try:
+            with open(os.path.join(PROFILE_DIR, name), "rb") as f:
+                summary = orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            continue
+        summary.pop("top", None)
+        profiles.append(summary)
+    return profiles
+
+
+def load_profile(profile_id: str):
+    if not safe_profile_id(profile_id):
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, profile_id + ".json"), "rb") as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def profile_path(profile_id: str):
+    """Path of the raw cProfile dump, or None"""
+    if not safe_profile_id(profile_id):
+        return None
+    path = os.path.join(PROFILE_DIR, profile_id + ".prof")
+    return path if os.path.exists(path) else None
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware profiling sampled requests, or one request when
+    X-Profile carries the admin token.
+
+    cProfile sees the whole thread, so only one request is profiled at a time
+    and the profile also contains whatever else the event loop ran meanwhile;
+    the Mongo and serialization times are the request's own.
+    """
+
+    def __init__(self, app, authorize, sample_rate: float = PROFILE_SAMPLE_RATE):
+        self.app = app
+        self.authorize = authorize
+        self.sample_rate = sample_rate
+        self.busy = False
+
+    def trigger(self, scope):
+        for name, value in scope.get("headers", []):
+            if name == PROFILE_HEADER:
+                return "header" if self.authorize(value.decode("latin-1")) else None
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sample"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.busy:
+            await self.app(scope, receive, send)
+            return
+        trigger = self.trigger(scope)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        request_id = scope.get("state", {}).get("request_id")
+        started = datetime.utcnow()
+        # The request id comes from the client (X-Request-ID); keep only the
+        # characters safe_profile_id accepts
+        suffix = "".join(c for c in request_id or "" if c.isascii() and (c.isalnum() or c == "-"))
+        profile_id = f"{started:%Y%m%d%H%M%S%f}-{suffix or os.urandom(8).hex()}"[:80]
+        info = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                info["status"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        self.busy = True
+        timings = RequestTimings()
+        token = current.set(timings)
+        profiler = cProfile.Profile()
+        started_at = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.disable()
+            total = time.perf_counter() - started_at
+            current.reset(token)
+            self.busy = False
+
+            route = getattr(scope.get("route"), "path", None)
+            summary = {
+                "id": profile_id,
+                "request_id": request_id,
+                "trigger": trigger,
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": route,
+                "status": info["status"],
+                "started_at": started.isoformat(),
+                "total_ms": round(total * 1000, 3),
+                "mongo_ms": round(timings.mongo_seconds * 1000, 3),
+                "mongo_commands": timings.mongo_commands,
+                "serialization_ms": round(timings.serialization_seconds * 1000, 3),
+                # Everything else: handler code, validation, middleware
+                "handler_ms": round(max(0.0, total - timings.mongo_seconds - timings.serialization_seconds) * 1000, 3),
+                "top": top_functions(profiler),
+            }
+            try:
+                await asyncio.to_thread(save_profile, summary, profiler)
+                logger.info(f"Saved profile {profile_id} of {scope['method']} {scope['path']} ({summary['total_ms']} ms)")
+            except OSError as e:
+                logger.error(f"Could not save profile {profile_id}: {e}")
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+from datetime import datetime
+from bson import ObjectId
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from db import client, courses_collection, purchases_collection, users_collection
+from indexes import INDEXES
+
+logger = logging.getLogger(__name__)
+
+
+class AlreadyPurchased(Exception):
+    """Raised when the user already owns the course; carries the existing record"""
+
+    def __init__(self, purchase: dict):
+        super().__init__("Course already purchased")
+        self.purchase = purchase
+
+
+class InsufficientBalance(Exception):
+    """Raised when a purchase that debits the balance finds it too low"""
+
+
+async def record_purchase(user: dict, course_id: str, course_title: str, price: float, purchase_key: str,
+                          debit: bool = False):
+    """Insert a purchase. The unique (user_id, course_id) index makes this the
+    single atomic step deciding ownership; a duplicate raises AlreadyPurchased.
+
+    With debit=True the insert and a conditional debit of the user's balance
+    run in one transaction (needs a replica set), so a course is never owned
+    without being paid for; a balance below price raises InsufficientBalance.
+    """
+    purchase = {
+        "user_id": str(user["_id"]),
+        "username": user["username"],
+        "course_id": str(course_id),
+        "course_title": course_title,
+        "price": price,
+        "purchase_date": datetime.utcnow(),
+        "purchase_key": purchase_key,
+    }
+
+    async def insert_and_debit(session):
+        await purchases_collection.insert_one(purchase, session=session)
+        charged = await users_collection.update_one(
+            {"_id": user["_id"], "balance": {"$gte": price}},
+            {"$inc": {"balance": -price}},
+            session=session
+        )
+        if charged.modified_count == 0:
+            raise InsufficientBalance()
+
+    try:
+        if debit:
+            async with client.start_session() as session:
+                await session.with_transaction(insert_and_debit)
+        else:
+            await purchases_collection.insert_one(purchase)
+        return purchase
+    except DuplicateKeyError:
+        existing = await purchases_collection.find_one({"user_id": str(user["_id"]), "course_id": str(course_id)})
+        raise AlreadyPurchased(existing)
+
+
+async def transactions_supported() -> bool:
+    """Multi-document transactions need a replica set or a sharded cluster"""
+    hello = await client.admin.command("hello")
+    return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+
+async def has_purchased(user_id: str, course_id: str) -> bool:
+    return await purchases_collection.find_one(
+        {"user_id": str(user_id), "course_id": str(course_id)}, {"_id": 1}
+    ) is not None
+
+
+async def get_purchased_course_ids(user_id: str):
+    """Ids of every course the user owns (answered from the index)"""
+    return await purchases_collection.distinct("course_id", {"user_id": str(user_id)})
+
+
+def purchases_page_query(base: dict, before=None):
+    """Keyset query for purchases newer-first; before is (purchase_date, _id)"""
+    if not before:
+        return base
+    purchase_date, purchase_id = before
+    return {"$and": [base, {"$or": [
+        {"purchase_date": {"$lt": purchase_date}},
+        {"purchase_date": purchase_date, "_id": {"$lt": purchase_id}},
+    ]}]}
+
+
+async def list_purchases(base: dict, limit: int, before=None):
+    """Return (page, has_more) of purchases matching base, newest first"""
+    page = await purchases_collection.find(purchases_page_query(base, before)).sort(
+        [("purchase_date", -1), ("_id", -1)]
+    ).limit(limit + 1).to_list(length=None)
+    return page[:limit], len(page) > limit
+
+
+async def migrate_embedded_purchases(batch_size: int = 500):
+    """One-shot migration of users' embedded purchase_history/purchased_courses
+    arrays into the purchases collection. Safe to re-run: duplicates are
+    skipped by the unique index and the arrays are only removed afterwards."""
+    # The unique index is what makes re-running the migration safe
+    await purchases_collection.create_indexes(INDEXES["purchases"])
+
+    migrated_users = 0
+    inserted = 0
+    cursor = users_collection.find(
+        {"$or": [{"purchase_history": {"$exists": True}}, {"purchased_courses": {"$exists": True}}]},
+        {"username": 1, "purchase_history": 1, "purchased_courses": 1}
+    ).batch_size(batch_size)
+
+    async for user in cursor:
+        user_id = str(user["_id"])
+        records = {}
+        for entry in user.get("purchase_history") or []:
+            records.setdefault(str(entry["course_id"]), entry)
+
+        # Courses owned without a history entry get a record built from the course
+        missing = [cid for cid in user.get("purchased_courses") or [] if str(cid) not in records]
+        if missing:
+            object_ids = [ObjectId(cid) for cid in missing if ObjectId.is_valid(str(cid))]
+            titles = {
+                str(course["_id"]): course
+                async for course in courses_collection.find({"_id": {"$in": object_ids}}, {"title": 1, "price": 1})
+            }
+            for cid in missing:
+                course = titles.get(str(cid), {})
+                records[str(cid)] = {
+                    "course_id": str(cid),
+                    "course_title": course.get("title", "Unknown Course"),
+                    "price": course.get("price", 0),
+                }
+
+        operations = [
+            InsertOne({
+                "user_id": user_id,
+                "username": user["username"],
+                "course_id": course_id,
+                "course_title": entry.get("course_title", "Unknown Course"),
+                "price": entry.get("price", 0),
+                "purchase_date": entry.get("purchase_date") or user["_id"].generation_time.replace(tzinfo=None),
+                "purchase_key": entry.get("purchase_key") or str(ObjectId()),
+            })
+            for course_id, entry in records.items()
+        ]
+        if operations:
+            try:
+                result = await purchases_collection.bulk_write(operations, ordered=False)
+                inserted += result.inserted_count
+            except BulkWriteError as e:
+                # Duplicate key errors mean the purchase was already migrated
+                errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+                if errors:
+                    logger.error(f"Failed to migrate purchases of {user['username']}: {errors}")
+                    continue
+                inserted += e.details.get("nInserted", 0)
+
+        await users_collection.update_one(
+            {"_id": user["_id"]},
+            {"$unset": {"purchase_history": "", "purchased_courses": ""}}
+        )
+        migrated_users += 1
+
+    logger.info(f"Migrated {inserted} purchases from {migrated_users} users")
+    return {"users": migrated_users, "purchases": inserted}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    summary = asyncio.run(migrate_embedded_purchases())
+    print(f"Migrated {summary['purchases']} purchases from {summary['users']} users.")
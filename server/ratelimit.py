@@ -0,0 +1,242 @@
+import os
+import re
+import math
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+import orjson
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Bucket storage: "memory" (per process), "local" (in-process stand-in for a
+# shared store) or "redis" (shared by every API process)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/1")
+# Buckets kept in memory; the least recently used are dropped (i.e. refilled)
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Take the client address from X-Forwarded-For (only behind a trusted proxy)
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true"
+
+
+class Limit:
+    """Token bucket refilling `count` tokens every `seconds`, holding at most `count`"""
+
+    def __init__(self, spec: str):
+        count, _, seconds = spec.partition("/")
+        self.burst = int(count)
+        self.rate = self.burst / float(seconds or 1)
+
+    def __repr__(self):
+        return f"Limit({self.burst}/{self.burst / self.rate:g}s)"
+
+
+# Limits as "requests/seconds"
+LIMITS = {
+    "login_ip": Limit(os.getenv("RATE_LIMIT_LOGIN_IP", "20/60")),
+    "login_account": Limit(os.getenv("RATE_LIMIT_LOGIN_ACCOUNT", "5/60")),
+    "signup_ip": Limit(os.getenv("RATE_LIMIT_SIGNUP_IP", "5/300")),
+    "purchase_ip": Limit(os.getenv("RATE_LIMIT_PURCHASE_IP", "60/60")),
+    "purchase_account": Limit(os.getenv("RATE_LIMIT_PURCHASE_ACCOUNT", "20/60")),
+}
+
+# Requests of a route class handled at once; more are answered 503
+CONCURRENCY_LIMITS = {
+    "auth": int(os.getenv("CONCURRENCY_LIMIT_AUTH", "32")),
+    "purchase": int(os.getenv("CONCURRENCY_LIMIT_PURCHASE", "64")),
+}
+
+# (method, path, route class, per-IP limit); every other route is not limited
+ROUTES = [
+    ("POST", re.compile(r"^/(login|admin/login)$"), "auth", "login_ip"),
+    ("POST", re.compile(r"^/signup$"), "auth", "signup_ip"),
+    ("POST", re.compile(r"^/courses/[^/]+/purchase$"), "purchase", "purchase_ip"),
+]
+
+
+def refill(tokens: float, updated: float, now: float, limit: Limit):
+    return min(limit.burst, tokens + max(0.0, now - updated) * limit.rate)
+
+
+def take(state, now: float, limit: Limit, cost: float = 1):
+    """Apply one request to a bucket state (tokens, updated) or None for a
+    full bucket. Returns (new state, seconds to wait or 0 when allowed)."""
+    tokens = refill(*state, now, limit) if state else limit.burst
+    if tokens >= cost:
+        return (tokens - cost, now), 0.0
+    return (tokens, now), (cost - tokens) / limit.rate
+
+
+class MemoryBuckets:
+    """Token buckets of this process, bounded as an LRU"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    async def take(self, key: str, limit: Limit, cost: float = 1) -> float:
+        state, wait = take(self._buckets.get(key), time.monotonic(), limit, cost)
+        self._buckets[key] = state
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class LocalSharedBuckets(MemoryBuckets):
+    """Stand-in for a shared store: bucket state is kept serialized and every
+    update is one atomic read-modify-write, as a server-side script would do"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        super().__init__(max_keys)
+        self._lock = asyncio.Lock()
+
+    async def take(self, key, limit, cost=1):
+        async with self._lock:
+            stored = self._buckets.get(key)
+            state, wait = take(orjson.loads(stored) if stored else None, time.time(), limit, cost)
+            self._buckets[key] = orjson.dumps(state)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+# KEYS[1] bucket; ARGV rate, burst, cost, now. Returns the wait in microseconds.
+REDIS_TAKE_SCRIPT = """
+local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = burst
+if state[1] then
+  tokens = math.min(burst, tonumber(state[1]) + math.max(0, now - tonumber(state[2])) * rate)
+end
+local wait = 0
+if tokens >= cost then
+  tokens = tokens - cost
+else
+  wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return math.floor(wait * 1000000)
+"""
+
+
+class RedisBuckets:
+    """Token buckets shared by every process (needs the optional `redis` package)"""
+
+    def __init__(self, url: str = RATE_LIMIT_REDIS_URL):
+        import redis.asyncio as redis
+        self.client = redis.from_url(url)
+        self._take = self.client.register_script(REDIS_TAKE_SCRIPT)
+
+    async def take(self, key, limit, cost=1):
+        wait = await self._take(keys=[f"ratelimit:{key}"], args=[limit.rate, limit.burst, cost, time.time()])
+        return int(wait) / 1e6
+
+
+def create_backend(name: str = RATE_LIMIT_BACKEND):
+    if name == "memory":
+        return MemoryBuckets()
+    if name == "local":
+        return LocalSharedBuckets()
+    if name == "redis":
+        return RedisBuckets()
+    raise ValueError(f"Unknown rate limit backend: {name}")
+
+
+class RateLimiter:
+    def __init__(self, backend, limits: dict = LIMITS, enabled: bool = RATE_LIMIT_ENABLED):
+        self.backend = backend
+        self.limits = limits
+        self.enabled = enabled
+
+    async def check(self, name: str, key: str) -> int:
+        """Take a token from the bucket of (limit name, key). Returns 0 when the
+        request may proceed, otherwise the seconds to wait (for Retry-After)."""
+        if not self.enabled or not key:
+            return 0
+        try:
+            wait = await self.backend.take(f"{name}:{key}", self.limits[name])
+        except Exception as e:
+            # A broken shared store must not lock everybody out
+            logger.error(f"Rate limit check {name} failed: {e}")
+            return 0
+        if wait <= 0:
+            return 0
+        metrics.RATE_LIMITED.inc(name)
+        return max(1, math.ceil(wait))
+
+
+limiter = RateLimiter(create_backend())
+
+
+def client_address(scope) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        for name, value in scope.get("headers", []):
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    return scope["client"][0] if scope.get("client") else ""
+
+
+def route_class(method: str, path: str):
+    """(route class, per-IP limit name) of a request, or None"""
+    for route_method, pattern, name, ip_limit in ROUTES:
+        if method == route_method and pattern.match(path):
+            return name, ip_limit
+    return None
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware applying the per-IP rate limits and the concurrency
+    caps of the limited route classes before any body is read. Requests over a
+    rate limit get 429, requests over a concurrency cap 503, both with
+    Retry-After. Other routes (the catalog) pass straight through."""
+
+    def __init__(self, app, headers: dict = None, limiter: RateLimiter = limiter,
+                 concurrency_limits: dict = CONCURRENCY_LIMITS):
+        self.app = app
+        self.headers = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in (headers or {}).items()]
+        self.limiter = limiter
+        self.concurrency_limits = concurrency_limits
+        self.in_flight = {name: 0 for name in concurrency_limits}
+
+    async def reject(self, send, status: int, detail: str, retry_after: int):
+        body = orjson.dumps({"detail": detail})
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": self.headers + [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after", str(retry_after).encode("latin-1")),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        matched = route_class(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if matched is None or not self.limiter.enabled:
+            await self.app(scope, receive, send)
+            return
+        name, ip_limit = matched
+
+        retry_after = await self.limiter.check(ip_limit, client_address(scope))
+        if retry_after:
+            await self.reject(send, 429, "Too many requests, please try again later", retry_after)
+            return
+
+        cap = self.concurrency_limits.get(name)
+        if cap is not None and self.in_flight[name] >= cap:
+            metrics.ADMISSION_REJECTED.inc(name)
+            logger.warning(f"Rejected {scope['method']} {scope['path']}: {name} routes at their concurrency limit ({cap})")
+            await self.reject(send, 503, "Server is busy, please try again", 1)
+            return
+
+        self.in_flight[name] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight[name] -= 1
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from db import courses_collection, reviews_collection
+
+logger = logging.getLogger(__name__)
+
+STARS = ["1", "2", "3", "4", "5"]
+
+
+def star_bucket(rating: float) -> str:
+    """Histogram bucket (1-5 stars) for a review rating, rounding half up"""
+    return str(min(5, max(1, int(rating + 0.5))))
+
+
+def empty_aggregate() -> dict:
+    return {"rating_count": 0, "rating_sum": 0, "rating_histogram": {star: 0 for star in STARS}}
+
+
+def course_filter(course_id: str) -> dict:
+    return {"_id": ObjectId(course_id) if ObjectId.is_valid(course_id) else course_id}
+
+
+async def apply_review_change(course_id: str, old_rating: float = None, new_rating: float = None):
+    """Update the running rating aggregates of a course.
+
+    Pass only new_rating for a created review, only old_rating for a deleted
+    one and both for an edit. Counters are changed with a single atomic $inc;
+    the mean is then written only if no other change landed in between.
+    """
+    inc = {"rating_count": 0, "rating_sum": 0}
+    if old_rating is not None:
+        inc["rating_count"] -= 1
+        inc["rating_sum"] -= old_rating
+        inc[f"rating_histogram.{star_bucket(old_rating)}"] = -1
+    if new_rating is not None:
+        inc["rating_count"] += 1
+        inc["rating_sum"] += new_rating
+        bucket = f"rating_histogram.{star_bucket(new_rating)}"
+        inc[bucket] = inc.get(bucket, 0) + 1
+
+    course = await courses_collection.find_one_and_update(
+        course_filter(course_id),
+        {"$inc": inc},
+        projection={"rating_count": 1, "rating_sum": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not course:
+        return None
+
+    count = course.get("rating_count", 0)
+    total = course.get("rating_sum", 0)
+    mean = round(total / count, 1) if count > 0 else 0
+    await courses_collection.update_one(
+        {**course_filter(course_id), "rating_count": count, "rating_sum": total},
+        {"$set": {"rating": mean}}
+    )
+    return mean
+
+
+async def reconcile_course_ratings(course_id: str = None):
+    """Rebuild the rating aggregates from the reviews collection.
+
+    Reconciles one course, or every course that has reviews when course_id
+    is None. Returns the number of courses updated.
+    """
+    match = {"course_id": course_id} if course_id else {}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {"course_id": "$course_id", "star": {"$min": [5, {"$max": [1, {"$floor": {"$add": ["$rating", 0.5]}}]}]}},
+            "count": {"$sum": 1},
+            "sum": {"$sum": "$rating"},
+        }},
+    ]
+
+    aggregates = {}
+    async for row in await reviews_collection.aggregate(pipeline):
+        course_aggregate = aggregates.setdefault(row["_id"]["course_id"], empty_aggregate())
+        course_aggregate["rating_count"] += row["count"]
+        course_aggregate["rating_sum"] += row["sum"]
+        course_aggregate["rating_histogram"][str(int(row["_id"]["star"]))] += row["count"]
+
+    # Courses whose reviews were all removed get their aggregates reset
+    if course_id:
+        aggregates.setdefault(course_id, empty_aggregate())
+    else:
+        async for course in courses_collection.find({"rating_count": {"$gt": 0}}, {"_id": 1}):
+            aggregates.setdefault(str(course["_id"]), empty_aggregate())
+
+    operations = []
+    for reviewed_course_id, course_aggregate in aggregates.items():
+        count = course_aggregate["rating_count"]
+        course_aggregate["rating"] = round(course_aggregate["rating_sum"] / count, 1) if count else 0
+        operations.append(UpdateOne(course_filter(reviewed_course_id), {"$set": course_aggregate}))
+
+    modified = 0
+    if operations:
+        result = await courses_collection.bulk_write(operations, ordered=False)
+        modified = result.modified_count
+        logger.info(f"Reconciled rating aggregates for {modified} of {len(operations)} courses")
+    if not course_id:
+        # Courses created before the aggregates existed and never reviewed:
+        # start their counters at zero but keep their initial rating
+        result = await courses_collection.update_many({"rating_count": {"$exists": False}}, {"$set": empty_aggregate()})
+        modified += result.modified_count
+    return modified
+
+
+async def backfill_rating_aggregates():
+    """Build the aggregates of courses that predate them, before a review
+    change $incs counters starting from zero. Returns the courses updated."""
+    if await courses_collection.find_one({"rating_count": {"$exists": False}}, {"_id": 1}) is None:
+        return 0
+    logger.info("Courses without rating aggregates found, rebuilding them from the reviews")
+    return await reconcile_course_ratings()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    updated = asyncio.run(reconcile_course_ratings())
+    print(f"Rating aggregates rebuilt for {updated} courses.")
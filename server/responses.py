@@ -0,0 +1,115 @@
+import base64
+import hashlib
+from typing import Any, Optional
+import orjson
+from bson import ObjectId, Decimal128
+from fastapi.responses import JSONResponse, Response
+import compression
+import profiling
+
+
+def _default(obj):
+    """Encode the BSON types orjson does not know about"""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, Decimal128):
+        return str(obj.to_decimal())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize documents straight from Mongo (ObjectId, datetime, ...) in one pass"""
+    return profiling.timed_serialization(_orjson_dumps, content)
+
+
+def _orjson_dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+
+class BSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson that understands ObjectId and datetime,
+    so handlers can return raw Mongo documents without converting them first"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag from the content hash of a rendered body"""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def render(content: Any) -> dict:
+    """Serialize content once; the result can be cached and sent as-is"""
+    body = dumps(content)
+    return {"body": body, "etag": make_etag(body)}
+
+
+async def render_precompressed(content: Any) -> dict:
+    """render, plus the compressed variants built once (off the event loop)"""
+    rendered = render(content)
+    rendered["encoded"] = await compression.precompress_async(rendered["body"])
+    return rendered
+
+
+def pack(rendered: dict) -> dict:
+    """JSON-safe copy of a rendered body for a shared cache: the body as text
+    and the compressed variants as base64. Local copies keep the raw bytes.
+    Other values (plain documents) are returned as they are."""
+    if "body" not in rendered:
+        return rendered
+    packed = {**rendered, "body": rendered["body"].decode()}
+    if rendered.get("encoded"):
+        packed["encoded"] = {name: base64.b64encode(data).decode() for name, data in rendered["encoded"].items()}
+    return packed
+
+
+def unpack(packed: dict) -> dict:
+    """Reverse of pack"""
+    if "body" not in packed:
+        return packed
+    rendered = {**packed, "body": packed["body"].encode()}
+    if packed.get("encoded"):
+        rendered["encoded"] = {name: base64.b64decode(data) for name, data in packed["encoded"].items()}
+    return rendered
+
+
+def etag_matches(if_none_match: Optional[str], etag: str):
+    """Return the tag of If-None-Match matching etag, or None. Uses the weak
+    comparison, so W/ prefixes and content-coding suffixes are ignored."""
+    if not if_none_match:
+        return None
+    if if_none_match.strip() == "*":
+        return etag
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        compare = tag[2:] if tag.startswith("W/") else tag
+        for encoding in compression.CODECS:
+            suffix = f'-{encoding}"'
+            if compare.endswith(suffix):
+                compare = compare[:-len(suffix)] + '"'
+                break
+        if compare == etag:
+            return tag
+    return None
+
+
+def conditional_response(rendered: dict, if_none_match: Optional[str], headers: dict,
+                         accept_encoding: Optional[str] = None) -> Response:
+    """Send a rendered body with its ETag, or 304 Not Modified when the client
+    has it. Precompressed variants (rendered["encoded"]) are sent as they are."""
+    matched = etag_matches(if_none_match, rendered["etag"])
+    if matched:
+        return Response(status_code=304, headers={**headers, "ETag": matched})
+
+    encoded = rendered.get("encoded")
+    if encoded:
+        headers = {**headers, "Vary": "Accept-Encoding"}
+        codec = compression.negotiate(accept_encoding)
+        if codec is not None and codec.name in encoded:
+            headers["ETag"] = compression.encoded_etag(rendered["etag"], codec.name)
+            headers["Content-Encoding"] = codec.name
+            return Response(content=encoded[codec.name], media_type="application/json", headers=headers)
+
+    headers = {**headers, "ETag": rendered["etag"]}
+    return Response(content=rendered["body"], media_type="application/json", headers=headers)
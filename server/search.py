@@ -0,0 +1,125 @@
+import re
+from db import courses_collection
+import instructors
+
+# Facet buckets as (lower bound, label); the last bucket is open ended
+PRICE_BUCKETS = [(0, "free"), (0.01, "0-25"), (25, "25-50"), (50, "50-100"), (100, "100+")]
+RATING_BUCKETS = [(0, "0-1"), (1, "1-2"), (2, "2-3"), (3, "3-4"), (4, "4-5")]
+
+# Fields returned for each hit
+RESULT_PROJECTION = {
+    "title": 1, "description": 1, "difficulty": 1, "price": 1, "rating": 1,
+    "rating_count": 1, "thumbnail": 1, "instructor": 1, "instructor_info": 1,
+}
+
+
+def bucket_stage(field: str, buckets: list) -> dict:
+    return {"$bucket": {
+        "groupBy": field,
+        "boundaries": [lower for lower, _ in buckets] + [float("inf")],
+        "default": "other",
+    }}
+
+
+def bucket_counts(rows: list, buckets: list) -> dict:
+    labels = dict(buckets)
+    return {labels.get(row["_id"], "other"): row["count"] for row in rows}
+
+
+def build_match(q: str = None, difficulty: str = None, min_price: float = None, max_price: float = None,
+                min_rating: float = None, verified: bool = None) -> dict:
+    clauses = []
+    if q:
+        # Served by the title/description text index
+        clauses.append({"$text": {"$search": q}})
+    if difficulty:
+        clauses.append({"difficulty": difficulty})
+    if min_price is not None or max_price is not None:
+        price = {}
+        if min_price is not None:
+            price["$gte"] = min_price
+        if max_price is not None:
+            price["$lte"] = max_price
+        clauses.append({"price": price})
+    if min_rating is not None:
+        clauses.append({"rating": {"$gte": min_rating}})
+    if verified is not None:
+        clauses.append({"instructor_info.isVerified": True} if verified else {"instructor_info.isVerified": {"$ne": True}})
+    if not clauses:
+        return {}
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def build_hits_pipeline(match: dict, limit: int, after_filter: dict = None) -> list:
+    """Page of text search hits ranked by score. The $sort is followed by the
+    $limit, so the server keeps only the top limit + 1 hits in memory."""
+    pipeline = [
+        {"$match": match},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+    if after_filter:
+        pipeline.append({"$match": after_filter})
+    return pipeline + [
+        {"$sort": {"score": -1, "_id": -1}},
+        # One extra hit tells whether there is a next page
+        {"$limit": limit + 1},
+        {"$project": {**RESULT_PROJECTION, "score": 1}},
+    ]
+
+
+def build_facets_pipeline(match: dict) -> list:
+    """The total and every facet of a query; no documents are sorted or returned"""
+    return [
+        {"$match": match},
+        {"$facet": {
+            "total": [{"$count": "count"}],
+            "difficulty": [{"$group": {"_id": "$difficulty", "count": {"$sum": 1}}}],
+            "price": [bucket_stage("$price", PRICE_BUCKETS)],
+            "rating": [bucket_stage("$rating", RATING_BUCKETS)],
+            "verified": [{"$group": {"_id": {"$eq": ["$instructor_info.isVerified", True]}, "count": {"$sum": 1}}}],
+        }},
+    ]
+
+
+def format_facets(result: dict) -> dict:
+    return {
+        "difficulty": {str(row["_id"]): row["count"] for row in result["difficulty"] if row["_id"] is not None},
+        "price": bucket_counts(result["price"], PRICE_BUCKETS),
+        "rating": bucket_counts(result["rating"], RATING_BUCKETS),
+        "verified": {str(row["_id"]).lower(): row["count"] for row in result["verified"]},
+    }
+
+
+async def search_hits(match: dict, ranked: bool, limit: int, after_filter: dict = None):
+    """Return (hits, has_more). Ranked searches sort the text matches by score;
+    otherwise hits are newest first, read off the _id index and stopping after
+    limit + 1 documents instead of sorting the whole match set."""
+    if ranked:
+        pipeline = build_hits_pipeline(match, limit, after_filter)
+        hits = await (await courses_collection.aggregate(pipeline)).to_list(length=None)
+    else:
+        query = {"$and": [match, after_filter]} if match and after_filter else (after_filter or match)
+        cursor = courses_collection.find(query, RESULT_PROJECTION).sort("_id", -1).limit(limit + 1)
+        hits = await cursor.to_list(length=None)
+        for hit in hits:
+            hit["score"] = 0
+
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+    for hit in hits:
+        hit["instructor"] = instructors.course_instructor(hit)
+        hit.pop("instructor_info", None)
+    return hits, has_more
+
+
+async def search_facets(match: dict) -> dict:
+    """Return {"total", "facets"} of a query, shared by all of its pages"""
+    results = await (await courses_collection.aggregate(build_facets_pipeline(match))).to_list(length=None)
+    result = results[0] if results else {"total": [], "difficulty": [], "price": [], "rating": [], "verified": []}
+    total = result["total"][0]["count"] if result["total"] else 0
+    return {"total": total, "facets": format_facets(result)}
+
+
+def normalize_query(q: str) -> str:
+    """Collapse whitespace so equivalent queries share a cache entry"""
+    return re.sub(r"\s+", " ", q or "").strip()[:200]
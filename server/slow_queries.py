@@ -0,0 +1,276 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, Counter
+import orjson
+from pymongo import monitoring
+import access_log
+import indexes
+
+logger = logging.getLogger(__name__)
+
+# Commands slower than this are logged and aggregated
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+# Distinct query shapes kept; the least recently seen are dropped past this
+SLOW_QUERY_MAX_SHAPES = int(os.getenv("SLOW_QUERY_MAX_SHAPES", "500"))
+# Re-run slow reads with explain() to learn how many documents they examine,
+# at most once per shape per interval (seconds)
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "true").lower() == "true"
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "600"))
+
+# Fields the top-N report can be sorted by
+REPORT_SORT_KEYS = ("total_ms", "count", "max_ms", "returned_max")
+
+EXPLAINABLE = {"find", "aggregate", "count", "distinct"}
+# Command fields that belong to the session or transport, not the query
+TRANSPORT_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern"}
+
+
+def redact(value):
+    """Query shape: keys and operators are kept, values become "?" (lists of
+    values too, so $in with 3 or 300 ids has one shape)"""
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+        return [redact(item) for item in value]
+    return "?"
+
+
+def command_collection(command_name: str, command: dict) -> str:
+    if command_name == "getMore":
+        return command.get("collection", "")
+    target = command.get(command_name)
+    return target if isinstance(target, str) else ""
+
+
+def command_shape(command_name: str, command: dict) -> dict:
+    """The redacted filter (and sort) of a command"""
+    if command_name == "find":
+        shape = {"filter": redact(command.get("filter", {}))}
+        if command.get("sort"):
+            shape["sort"] = dict(command["sort"])
+        return shape
+    if command_name == "aggregate":
+        return {"pipeline": [redact(stage) for stage in command.get("pipeline", [])]}
+    if command_name in ("count", "distinct"):
+        shape = {"filter": redact(command.get("query", {}))}
+        if command_name == "distinct":
+            shape["key"] = command.get("key")
+        return shape
+    if command_name == "findAndModify":
+        shape = {"filter": redact(command.get("query", {}))}
+        if command.get("sort"):
+            shape["sort"] = dict(command["sort"])
+        return shape
+    if command_name in ("update", "delete"):
+        statements = command.get("updates" if command_name == "update" else "deletes", [])
+        return {"filter": redact(statements[0].get("q", {}))} if statements else {}
+    return {}
+
+
+def returned_count(command_name: str, reply: dict):
+    """Documents returned (or written) according to the reply"""
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    if command_name == "distinct":
+        return len(reply.get("values", []))
+    if command_name == "findAndModify":
+        return 1 if reply.get("value") else 0
+    if command_name == "update":
+        return reply.get("nModified", reply.get("n"))
+    return reply.get("n")
+
+
+def request_origin():
+    """(route, request id) of the request running the command"""
+    scope = access_log.current_request.get()
+    if scope is None:
+        return "background", None
+    route = getattr(scope.get("route"), "path", None) or scope.get("path")
+    return f"{scope.get('method')} {route}", scope.get("state", {}).get("request_id")
+
+
+class SlowQueryLog:
+    """Aggregates slow commands by (collection, command, shape)"""
+
+    def __init__(self, max_shapes: int = SLOW_QUERY_MAX_SHAPES):
+        self.max_shapes = max_shapes
+        self._shapes = OrderedDict()
+        self.recorded = 0
+
+    def record(self, collection: str, command_name: str, shape: dict, ms: float, returned, route: str,
+               request_id=None) -> dict:
+        key = (collection, command_name, orjson.dumps(shape, option=orjson.OPT_SORT_KEYS).decode())
+        entry = self._shapes.get(key)
+        if entry is None:
+            entry = self._shapes[key] = {
+                "collection": collection,
+                "command": command_name,
+                "shape": shape,
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "returned_total": 0,
+                "returned_max": 0,
+                "examined": None,
+                "routes": Counter(),
+                "explained_at": None,
+            }
+            while len(self._shapes) > self.max_shapes:
+                self._shapes.popitem(last=False)
+        else:
+            self._shapes.move_to_end(key)
+
+        self.recorded += 1
+        entry["count"] += 1
+        entry["total_ms"] += ms
+        entry["max_ms"] = max(entry["max_ms"], ms)
+        if returned is not None:
+            entry["returned_total"] += returned
+            entry["returned_max"] = max(entry["returned_max"], returned)
+        entry["routes"][route] += 1
+        entry["last_seen"] = time.time()
+        entry["last_request_id"] = request_id
+        return entry
+
+    def report(self, top: int = 20, sort: str = "total_ms") -> list:
+        entries = sorted(self._shapes.values(), key=lambda entry: entry[sort], reverse=True)[:top]
+        return [
+            {
+                **{k: v for k, v in entry.items() if k not in ("routes", "explained_at")},
+                "total_ms": round(entry["total_ms"], 2),
+                "max_ms": round(entry["max_ms"], 2),
+                "avg_ms": round(entry["total_ms"] / entry["count"], 2),
+                "routes": dict(entry["routes"].most_common(5)),
+            }
+            for entry in entries
+        ]
+
+    def reset(self):
+        self._shapes.clear()
+        self.recorded = 0
+
+
+slow_log = SlowQueryLog()
+
+
+def explain_command(command_name: str, command: dict) -> dict:
+    """The command without its session/transport fields, wrapped in explain"""
+    query = {k: v for k, v in command.items() if not k.startswith("$") and k not in TRANSPORT_FIELDS}
+    return {"explain": query, "verbosity": "executionStats"}
+
+
+def find_key(doc, key):
+    """First value of key in a nested explain document"""
+    if isinstance(doc, dict):
+        if key in doc:
+            return doc[key]
+        children = doc.values()
+    elif isinstance(doc, list):
+        children = doc
+    else:
+        return None
+    for child in children:
+        found = find_key(child, key)
+        if found is not None:
+            return found
+    return None
+
+
+_explaining = False
+# Running explain tasks; the loop only keeps weak references to tasks
+_explain_tasks = set()
+
+
+def _explain_done(task: asyncio.Task):
+    _explain_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"explain() task failed: {task.exception()}")
+
+
+async def explain_entry(entry: dict, database_name: str, command_name: str, command: dict):
+    """Fill in the documents/keys examined and the plan stages of a slow shape"""
+    global _explaining
+    from db import client
+    try:
+        explain = await client[database_name].command(explain_command(command_name, command))
+        stats = find_key(explain, "executionStats") or {}
+        stages = list(indexes.plan_stages(find_key(explain, "winningPlan") or {}))
+        entry["examined"] = {
+            "docs": stats.get("totalDocsExamined"),
+            "keys": stats.get("totalKeysExamined"),
+            "returned": stats.get("nReturned"),
+            "stages": stages,
+            "collection_scan": "COLLSCAN" in stages,
+        }
+    except Exception as e:
+        logger.warning(f"explain() of a slow {command_name} on {entry['collection']} failed: {e}")
+    finally:
+        _explaining = False
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    """Records commands slower than SLOW_QUERY_MS with their redacted shape,
+    duration, documents returned and the route that issued them"""
+
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS):
+        self.threshold_ms = threshold_ms
+        self._started = {}
+
+    def started(self, event):
+        if event.command_name == "explain":
+            return
+        route, request_id = request_origin()
+        self._started[(event.connection_id, event.request_id)] = (
+            event.command, event.database_name, route, request_id
+        )
+
+    def succeeded(self, event):
+        started = self._started.pop((event.connection_id, event.request_id), None)
+        if started is not None and event.duration_micros / 1000 >= self.threshold_ms:
+            self.record(event, started, event.reply)
+
+    def failed(self, event):
+        started = self._started.pop((event.connection_id, event.request_id), None)
+        if started is not None and event.duration_micros / 1000 >= self.threshold_ms:
+            self.record(event, started, {})
+
+    def record(self, event, started, reply):
+        global _explaining
+        command, database_name, route, request_id = started
+        ms = event.duration_micros / 1000
+        collection = command_collection(event.command_name, command)
+        shape = command_shape(event.command_name, command)
+        returned = returned_count(event.command_name, reply)
+        entry = slow_log.record(collection, event.command_name, shape, ms, returned, route, request_id)
+
+        logger.warning(orjson.dumps({
+            "slow_query": event.command_name,
+            "collection": collection,
+            "shape": shape,
+            "ms": round(ms, 2),
+            "returned": returned,
+            "route": route,
+            "request_id": request_id,
+        }).decode())
+
+        now = time.monotonic()
+        if (
+            SLOW_QUERY_EXPLAIN and event.command_name in EXPLAINABLE and not _explaining
+            and not any("$out" in stage or "$merge" in stage for stage in command.get("pipeline", []))
+            and (entry["explained_at"] is None or now - entry["explained_at"] >= SLOW_QUERY_EXPLAIN_INTERVAL)
+        ):
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            _explaining = True
+            entry["explained_at"] = now
+            task = loop.create_task(explain_entry(entry, database_name, event.command_name, command))
+            _explain_tasks.add(task)
+            task.add_done_callback(_explain_done)
+
+
+mongo_listener = SlowQueryListener()
@@ -0,0 +1,367 @@
+import os
+import re
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Which backend uploaded videos go to: "cloudinary" or "local"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "cloudinary")
+# Local stand-in settings
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "media"))
+LOCAL_STORAGE_BASE_URL = os.getenv("LOCAL_STORAGE_BASE_URL", "http://localhost:8000/media")
+# Size of the parts sent to Cloudinary (their minimum is 5 MB, except for the last part)
+CLOUDINARY_PART_SIZE = int(os.getenv("CLOUDINARY_PART_SIZE", str(20 * 1024 * 1024)))
+# Size of the chunks read from the request body / spooled upload
+UPLOAD_READ_CHUNK_SIZE = int(os.getenv("UPLOAD_READ_CHUNK_SIZE", str(1024 * 1024)))
+# Transfers allowed to run at the same time
+MAX_CONCURRENT_UPLOADS = int(os.getenv("MAX_CONCURRENT_UPLOADS", "4"))
+# Largest accepted video
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(5 * 1024 * 1024 * 1024)))
+# Resumable sessions idle for longer than this are aborted
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", "3600"))
+# Resumable sessions open at the same time; each may buffer up to a part in memory
+MAX_UPLOAD_SESSIONS = int(os.getenv("MAX_UPLOAD_SESSIONS", "100"))
+# How often idle sessions are looked for (seconds)
+UPLOAD_SESSION_SWEEP_INTERVAL = float(os.getenv("UPLOAD_SESSION_SWEEP_INTERVAL", "60"))
+
+
+class UploadError(Exception):
+    """Raised when an upload cannot be stored"""
+
+
+class UploadBusy(UploadError):
+    """Raised when all upload slots are in use"""
+
+
+class UploadOffsetMismatch(UploadError):
+    """Raised when a chunk does not start where the previous one ended"""
+
+    def __init__(self, expected: int):
+        super().__init__(f"Expected chunk starting at byte {expected}")
+        self.expected = expected
+
+
+def safe_filename(filename: str) -> str:
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", os.path.basename(filename or "video"))
+    return name[-100:] or "video"
+
+
+class StorageBackend:
+    """Where uploaded videos end up. Data is written in order, chunk by chunk,
+    so a backend never needs the whole file in memory or on local disk."""
+
+    # Video URLs handed out by this backend start with this prefix
+    url_prefix = ""
+
+    async def open(self, filename: str, total_size: int) -> dict:
+        raise NotImplementedError
+
+    async def write(self, state: dict, data: bytes):
+        raise NotImplementedError
+
+    async def complete(self, state: dict) -> str:
+        """Finish the upload and return the public URL"""
+        raise NotImplementedError
+
+    async def abort(self, state: dict):
+        raise NotImplementedError
+
+    def thumbnail_url(self, video_url: str):
+        """URL of a preview image for a stored video, if the backend makes one"""
+        return None
+
+
+class LocalStorageBackend(StorageBackend):
+    """Stores videos on the local filesystem, for development and tests"""
+
+    def __init__(self, root: str = LOCAL_STORAGE_DIR, base_url: str = LOCAL_STORAGE_BASE_URL):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+        self.url_prefix = self.base_url + "/"
+        os.makedirs(os.path.join(self.root, ".parts"), exist_ok=True)
+
+    async def open(self, filename, total_size):
+        name = f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}_{safe_filename(filename)}"
+        part_path = os.path.join(self.root, ".parts", name)
+        def create():
+            open(part_path, "wb").close()
+        await asyncio.to_thread(create)
+        return {"name": name, "part_path": part_path}
+
+    async def write(self, state, data):
+        def append():
+            with open(state["part_path"], "ab") as f:
+                f.write(data)
+        await asyncio.to_thread(append)
+
+    async def complete(self, state):
+        final_path = os.path.join(self.root, state["name"])
+        await asyncio.to_thread(os.replace, state["part_path"], final_path)
+        return f"{self.base_url}/{state['name']}"
+
+    async def abort(self, state):
+        try:
+            await asyncio.to_thread(os.unlink, state["part_path"])
+        except FileNotFoundError:
+            pass
+
+
+class CloudinaryStorageBackend(StorageBackend):
+    """Streams videos to Cloudinary with its chunked upload API. About one
+    part (CLOUDINARY_PART_SIZE) per upload is held in memory."""
+
+    url_prefix = "https://res.cloudinary.com/"
+
+    def __init__(self, part_size: int = CLOUDINARY_PART_SIZE, folder: str = "course_videos"):
+        self.part_size = part_size
+        self.folder = folder
+
+    async def open(self, filename, total_size):
+        import cloudinary
+        import cloudinary.utils
+
+        current_config = cloudinary.config()
+        if not current_config.cloud_name or not current_config.api_key or not current_config.api_secret:
+            raise UploadError("Cloudinary configuration is incomplete. Please check environment variables.")
+
+        return {
+            "filename": safe_filename(filename),
+            "total_size": total_size,
+            "upload_id": cloudinary.utils.random_public_id(),
+            "public_id": f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{safe_filename(filename)}",
+            "sent": 0,
+            "buffer": bytearray(),
+            "result": None,
+        }
+
+    async def _send_part(self, state, part: bytes):
+        import cloudinary.uploader
+
+        start = state["sent"]
+        headers = {
+            "Content-Range": f"bytes {start}-{start + len(part) - 1}/{state['total_size']}",
+            "X-Unique-Upload-Id": state["upload_id"],
+        }
+        result = await asyncio.to_thread(
+            cloudinary.uploader.upload_large_part,
+            (state["filename"], part),
+            http_headers=headers,
+            resource_type="video",
+            folder=self.folder,
+            public_id=state["public_id"],
+        )
+        state["sent"] += len(part)
+        state["public_id"] = result.get("public_id", state["public_id"])
+        state["result"] = result
+
+    async def _flush(self, state, final: bool = False):
+        """Send the full parts in the buffer (everything when final). A part
+        leaves the buffer only once Cloudinary accepted it, so after a failed
+        send the bytes are still there and the upload can resume."""
+        buffer = state["buffer"]
+        while buffer and (
+            final or (len(buffer) >= self.part_size and state["sent"] + len(buffer) < state["total_size"])
+        ):
+            await self._send_part(state, bytes(buffer[:self.part_size]))
+            del buffer[:self.part_size]
+
+    async def write(self, state, data):
+        # Parts are cut from bytes already counted as received; data is only
+        # buffered once they are sent, so a failed write takes none of it
+        await self._flush(state)
+        state["buffer"].extend(data)
+
+    async def complete(self, state):
+        await self._flush(state, final=True)
+
+        result = state["result"] or {}
+        logger.info(f"Cloudinary upload successful: {result.get('public_id')}")
+        if 'secure_url' not in result:
+            raise UploadError(f"Upload succeeded but no secure_url in response: {result}")
+        if 'demo' in result['secure_url']:
+            raise UploadError("Upload returned a demo URL. Check Cloudinary configuration.")
+        return result['secure_url']
+
+    def thumbnail_url(self, video_url):
+        # Cloudinary renders a frame of the video when asked for an image format
+        return re.sub(r"\.\w+$", ".jpg", video_url)
+
+    async def abort(self, state):
+        # Cloudinary discards incomplete chunked uploads on its own
+        state["buffer"] = bytearray()
+
+
+def create_backend(name: str = STORAGE_BACKEND) -> StorageBackend:
+    if name == "local":
+        return LocalStorageBackend()
+    if name == "cloudinary":
+        return CloudinaryStorageBackend()
+    raise ValueError(f"Unknown storage backend: {name}")
+
+
+class UploadSession:
+    def __init__(self, upload_id: str, owner: str, filename: str, total_size: int, state: dict):
+        self.upload_id = upload_id
+        self.owner = owner
+        self.filename = filename
+        self.total_size = total_size
+        self.state = state
+        self.received = 0
+        self.video_url = None
+        self.updated_at = time.time()
+        self.lock = asyncio.Lock()
+
+    @property
+    def complete(self) -> bool:
+        return self.video_url is not None
+
+    def as_dict(self):
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "size": self.total_size,
+            "offset": self.received,
+            "complete": self.complete,
+            "video_url": self.video_url,
+        }
+
+
+class UploadManager:
+    """Tracks resumable upload sessions and bounds concurrent transfers"""
+
+    def __init__(self, backend: StorageBackend, max_concurrent: int = MAX_CONCURRENT_UPLOADS,
+                 max_sessions: int = MAX_UPLOAD_SESSIONS):
+        self.backend = backend
+        self.max_concurrent = max_concurrent
+        self.max_sessions = max_sessions
+        self.active = 0
+        self.sessions = {}
+        self._slot_freed = asyncio.Event()
+
+    async def _acquire(self, wait: bool = False):
+        """Take a transfer slot; raises UploadBusy when all are in use, or with
+        wait waits for one (background ingestion, which has nobody to retry)"""
+        while self.active >= self.max_concurrent:
+            if not wait:
+                raise UploadBusy("Too many uploads in progress")
+            self._slot_freed.clear()
+            await self._slot_freed.wait()
+        self.active += 1
+
+    def _release(self):
+        self.active -= 1
+        self._slot_freed.set()
+
+    async def expire_sessions(self):
+        cutoff = time.time() - UPLOAD_SESSION_TTL
+        for upload_id, session in list(self.sessions.items()):
+            if session.updated_at < cutoff and not session.lock.locked():
+                await self.abort(upload_id)
+
+    async def create(self, owner: str, filename: str, total_size: int) -> UploadSession:
+        """Open a resumable session; raises UploadBusy when max_sessions are open"""
+        if len(self.sessions) >= self.max_sessions:
+            await self.expire_sessions()
+            if len(self.sessions) >= self.max_sessions:
+                raise UploadBusy("Too many upload sessions open")
+        return await self._open(owner, filename, total_size)
+
+    async def _open(self, owner: str, filename: str, total_size: int) -> UploadSession:
+        if total_size <= 0 or total_size > MAX_UPLOAD_SIZE:
+            raise UploadError(f"Upload size must be between 1 and {MAX_UPLOAD_SIZE} bytes")
+        state = await self.backend.open(filename, total_size)
+        session = UploadSession(uuid.uuid4().hex, owner, filename, total_size, state)
+        self.sessions[session.upload_id] = session
+        return session
+
+    def get(self, upload_id: str):
+        return self.sessions.get(upload_id)
+
+    async def write_stream(self, session: UploadSession, offset: int, stream, wait: bool = False) -> UploadSession:
+        """Append the bytes of an async iterator at offset; completes the upload
+        once total_size bytes were received. With wait, waits for a free
+        transfer slot instead of raising UploadBusy."""
+        if session.lock.locked():
+            raise UploadBusy("A chunk for this upload is already being written")
+        async with session.lock:
+            if session.complete:
+                return session
+            if offset != session.received:
+                raise UploadOffsetMismatch(session.received)
+
+            await self._acquire(wait)
+            try:
+                async for data in stream:
+                    if not data:
+                        continue
+                    if session.received + len(data) > session.total_size:
+                        raise UploadError("Upload is larger than the declared size")
+                    await self.backend.write(session.state, data)
+                    session.received += len(data)
+                    session.updated_at = time.time()
+
+                if session.received == session.total_size:
+                    session.video_url = await self.backend.complete(session.state)
+                    logger.info(f"Upload {session.upload_id} complete: {session.video_url}")
+            finally:
+                self._release()
+        return session
+
+    async def abort(self, upload_id: str):
+        session = self.sessions.pop(upload_id, None)
+        if session and not session.complete:
+            try:
+                await self.backend.abort(session.state)
+            except Exception as e:
+                logger.error(f"Error aborting upload {upload_id}: {str(e)}")
+
+    async def upload_stream(self, owner: str, filename: str, total_size: int, stream, wait: bool = False) -> str:
+        """One-shot upload of a whole stream; partial data is always cleaned up.
+        Not counted against max_sessions: transfers are bounded by the slots."""
+        session = await self._open(owner, filename, total_size)
+        try:
+            await self.write_stream(session, 0, stream, wait)
+            if not session.complete:
+                raise UploadError("Upload ended before all bytes were received")
+            return session.video_url
+        finally:
+            # Completed sessions are just forgotten, unfinished ones are aborted
+            await self.abort(session.upload_id)
+
+
+backend = create_backend()
+uploads = UploadManager(backend)
+
+
+async def sweep_sessions(interval: float = UPLOAD_SESSION_SWEEP_INTERVAL):
+    """Abort idle sessions every interval seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await uploads.expire_sessions()
+        except Exception as e:
+            logger.error(f"Error expiring upload sessions: {str(e)}")
+
+
+_sweeper = None
+
+
+def start_sweeper():
+    global _sweeper
+    if _sweeper is None:
+        _sweeper = asyncio.create_task(sweep_sessions())
+
+
+async def stop_sweeper():
+    global _sweeper
+    if _sweeper is not None:
+        _sweeper.cancel()
+        try:
+            await _sweeper
+        except asyncio.CancelledError:
+            pass
+        _sweeper = None
@@ -0,0 +1,123 @@
+import os
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from pymongo import AsyncMongoClient
+from pymongo.errors import OperationFailure
+import instructors
+
+# A real server for the tests that run the aggregation, e.g. mongodb://localhost:27017
+TEST_MONGO_URI = os.getenv("TEST_MONGO_URI")
+
+
+class FailingAggregate:
+    """Courses collection whose aggregate() raises the given error"""
+
+    def __init__(self, error):
+        self.error = error
+
+    async def aggregate(self, pipeline):
+        raise self.error
+
+
+def test_pipeline_projects_latest_reviews():
+    pipeline = instructors.dashboard_pipeline("inst", 3)
+    assert pipeline[0] == {"$match": {"instructor": "inst"}}
+    lookup = pipeline[1]["$lookup"]
+    assert lookup["as"] == "reviews"
+    assert lookup["pipeline"][1:] == [
+        {"$sort": {"created_at": -1, "_id": -1}},
+        {"$limit": 3},
+        {"$project": instructors.DASHBOARD_REVIEW_FIELDS},
+    ]
+    assert set(pipeline[-1]["$addFields"]) == {"review_count", "average_rating"}
+
+
+def test_pipeline_without_reviews():
+    pipeline = instructors.dashboard_pipeline("inst", 0)
+    assert not any("$lookup" in stage for stage in pipeline)
+    assert {"$addFields": {"reviews": []}} in pipeline
+
+
+def test_falls_back_only_when_the_pipeline_is_unsupported(monkeypatch):
+    async def fallback(username, reviews_limit):
+        return ["fallback"]
+
+    monkeypatch.setattr(instructors, "dashboard_courses_fallback", fallback)
+    monkeypatch.setattr(instructors, "courses_collection",
+                        FailingAggregate(OperationFailure("Unrecognized expression '$round'", 168)))
+    assert asyncio.run(instructors.dashboard_courses("inst", 3)) == ["fallback"]
+
+    # Transient errors are raised, and the next call tries the pipeline again
+    monkeypatch.setattr(instructors, "courses_collection",
+                        FailingAggregate(OperationFailure("operation exceeded time limit", 50)))
+    with pytest.raises(OperationFailure):
+        asyncio.run(instructors.dashboard_courses("inst", 3))
+
+
+class GroupedCourses:
+    """Courses collection whose aggregate() returns the given groups"""
+
+    def __init__(self, groups):
+        self.groups = groups
+
+    async def aggregate(self, pipeline):
+        groups = self.groups
+
+        class Cursor:
+            async def to_list(self, length=None):
+                return groups
+        return Cursor()
+
+
+def test_check_counts_drifted_courses_from_one_aggregation(monkeypatch):
+    ann = [{"role": "instructor", "isVerified": True}]
+    monkeypatch.setattr(instructors, "courses_collection", GroupedCourses([
+        {"_id": {"instructor": "ann", "info": {"username": "ann", "isVerified": True}}, "courses": 2, "user": ann},
+        {"_id": {"instructor": "ann", "info": {"username": "ann", "isVerified": False}}, "courses": 3, "user": ann},
+        {"_id": {"instructor": "ann"}, "courses": 1, "user": ann},
+        {"_id": {"instructor": "zed", "info": {"username": "zed", "isVerified": False}}, "courses": 4, "user": []},
+    ]))
+    report = asyncio.run(instructors.check_instructor_fields())
+    assert report == {"instructors": 2, "drifted": 4, "repaired": 0}
+
+
+@pytest.mark.skipif(not TEST_MONGO_URI, reason="TEST_MONGO_URI is not set")
+def test_pipeline_output_matches_fallback(monkeypatch):
+    async def run():
+        client = AsyncMongoClient(TEST_MONGO_URI)
+        db = client[f"test_instructors_{os.getpid()}"]
+        monkeypatch.setattr(instructors, "courses_collection", db["courses"])
+        monkeypatch.setattr(instructors, "reviews_collection", db["reviews"])
+        try:
+            rated = await db["courses"].insert_one({"title": "Rated", "instructor": "inst", "rating_count": 3, "rating_sum": 13})
+            await db["courses"].insert_one({"title": "New", "instructor": "inst"})
+            await db["courses"].insert_one({"title": "Other", "instructor": "other"})
+            now = datetime.utcnow()
+            await db["reviews"].insert_many([
+                {"course_id": str(rated.inserted_id), "user_id": f"u{i}", "username": f"user{i}",
+                 "rating": 4 + i % 2, "comment": "ok", "created_at": now - timedelta(minutes=i), "extra": True}
+                for i in range(3)
+            ])
+
+            pipeline = await (await db["courses"].aggregate(instructors.dashboard_pipeline("inst", 2))).to_list(None)
+            fallback = await instructors.dashboard_courses_fallback("inst", 2)
+            return pipeline, fallback
+        finally:
+            await client.drop_database(db.name)
+            await client.close()
+
+    pipeline, fallback = asyncio.run(run())
+    by_title = {course["title"]: course for course in pipeline}
+    assert set(by_title) == {"Rated", "New"}
+
+    rated = by_title["Rated"]
+    assert rated["review_count"] == 3
+    assert rated["average_rating"] == 4.33
+    assert [review["username"] for review in rated["reviews"]] == ["user0", "user1"]
+    assert set(rated["reviews"][0]) == set(instructors.DASHBOARD_REVIEW_FIELDS) | {"_id"}
+    assert by_title["New"]["reviews"] == []
+    assert by_title["New"]["review_count"] == 0
+    assert by_title["New"]["average_rating"] is None
+
+    assert sorted(pipeline, key=lambda course: course["title"]) == sorted(fallback, key=lambda course: course["title"])